@@ -0,0 +1,107 @@
+import argparse
+import random
+import sys
+from threading import Thread
+from timeit import default_timer
+
+
+py_version = sys.version_info[0]
+
+
+if py_version == 3:
+    from python3.dictionary import Dictionary
+else:
+    from python2.dictionary import Dictionary
+    range = xrange
+
+
+# Return a list of ops operations for one thread, where an operation is a
+# (kind, key) pair and kind is 'get', 'set' or 'pop'. The writes are half
+# sets and half pops of keys in range(2 * keys), so the dictionary keeps
+# about keys items, and the dummies left by the pops make the entry table
+# get cleaned up now and then when there are many writes.
+def make_operations(ops, write_ratio, keys, seed):
+    rng = random.Random(seed)
+    operations = []
+    for _ in range(ops):
+        key = rng.randrange(2 * keys)
+        if rng.random() >= write_ratio:
+            operations.append(('get', key))
+        elif rng.random() < 0.5:
+            operations.append(('set', key))
+        else:
+            operations.append(('pop', key))
+    return operations
+
+
+def worker(dictionary, operations):
+    get = dictionary.get
+    pop = dictionary.pop
+    for kind, key in operations:
+        if kind == 'get':
+            get(key)
+        elif kind == 'set':
+            dictionary[key] = key
+        else:
+            pop(key, -1)
+
+
+def run(threads, write_ratio, ops=100000, keys=10000):
+    """Run ops operations, split over threads threads, on a dictionary which
+       starts with keys items, where write_ratio of the operations are 
+       writes. Return the operations per second and the lock stats"""
+    dictionary = Dictionary((key, key) for key in range(0, 2 * keys, 2))
+    dictionary.enable_lock_stats()
+    workers = [Thread(target=worker, args=(dictionary, make_operations(
+                   ops // threads, write_ratio, keys, seed)))
+               for seed in range(threads)]
+
+    start = default_timer()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = default_timer() - start
+
+    return (ops // threads) * threads / elapsed, dictionary.lock_stats()
+
+
+def sweep(thread_counts, write_ratios, ops=100000, keys=10000,
+          stream=sys.stdout):
+    """Run every combination of thread count and write ratio and write a
+       table with the throughput and the lock contention to stream"""
+    columns = ('threads', 'writes', 'ops/sec', 'locks', 'contended',
+               'wait ms', 'max wait ms', 'hold ms', 'resizes', 'resize ms')
+    row = '{:>8} {:>7} {:>10} {:>8} {:>10} {:>9} {:>12} {:>9} {:>8} {:>10}\n'
+    stream.write(row.format(*columns))
+    for threads in thread_counts:
+        for write_ratio in write_ratios:
+            throughput, stats = run(threads, write_ratio, ops, keys)
+            stream.write(row.format(
+                threads, write_ratio, int(throughput), stats['acquisitions'],
+                stats['contended'], '{:.1f}'.format(stats['wait_time'] * 1e3),
+                '{:.2f}'.format(stats['max_wait'] * 1e3),
+                '{:.1f}'.format(stats['hold_time'] * 1e3), stats['resizes'],
+                '{:.1f}'.format(stats['resize_time'] * 1e3)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure how the throughput of a Dictionary shared by '
+                    'threads scales with the thread count and write ratio')
+    parser.add_argument('--threads', default='1,2,4,8',
+                        help='comma separated thread counts')
+    parser.add_argument('--writes', default='0,0.1,0.5,0.9',
+                        help='comma separated ratios of writes')
+    parser.add_argument('--ops', type=int, default=100000,
+                        help='operations per run')
+    parser.add_argument('--keys', type=int, default=10000,
+                        help='number of items in the dictionary')
+    args = parser.parse_args()
+    sweep([int(threads) for threads in args.threads.split(',')],
+          [float(ratio) for ratio in args.writes.split(',')],
+          args.ops, args.keys)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,18 @@
 # inspired by Brandon Craig Rhodes talk from PyCon 2010: The Mighty Dictionary
 
 
+import cPickle as pickle
+from sys import getsizeof
 from threading import RLock
-from ctypes import c_size_t
-from itertools import izip
+from ctypes import c_size_t, sizeof
+from types import MemberDescriptorType
+from random import SystemRandom
+from os import rename, SEEK_END
+from tempfile import TemporaryFile
+from time import time as _clock
+from itertools import izip, islice, chain
+from functools import partial
+from multiprocessing import Pool
 
 
 # Meta class to control what class name type returns
@@ -15,6 +24,17 @@ class TypeReturn(type):
         return "<type '{}'>".format(name)
 
 
+# Meta class which gives a class the frozenset _slot_names, with the names
+# of the slot descriptors of the class and its bases, so Dictionary can 
+# tell an instance variable from a key with a single set lookup
+class _SlotNames(type):
+    def __init__(cls, name, bases, namespace):
+        super(_SlotNames, cls).__init__(name, bases, namespace)
+        cls._slot_names = frozenset(
+            slot for klass in cls.__mro__ for slot, attr in vars(klass).items()
+            if type(attr) is MemberDescriptorType)
+
+
 # Dummy class for leaving a dummy value until next
 # time the dictionary gets resized in case a key already has collided with
 # the index where the deleted object was stored
@@ -30,14 +50,13 @@ class __dictionary_iterator(object):
        iterator over dictionary items, keys or values"""
     
     __metaclass__ = TypeReturn
+
+    __slots__ = ('__sequence', '__dictionary', '__layout')
     
     def __init__(self, sequence_gen, dictionary):
-        global _iter_counter, _iter_local_vars
-        _iter_counter = 0
-        _iter_local_vars = 3
-        self.__sequence = sequence_gen
-        self.__dictionary = dictionary
-        self.__size = len(dictionary)
+        object.__setattr__(self, '_dictionary_iterator__sequence', sequence_gen)
+        object.__setattr__(self, '_dictionary_iterator__dictionary', dictionary)
+        object.__setattr__(self, '_dictionary_iterator__layout', dictionary._layout)
         # Hide the underscore from class name whenever printing it
         name = self.__class__.__name__
         self.__class__.__name__ = name[1:] if name.startswith('_') else name
@@ -46,8 +65,8 @@ class __dictionary_iterator(object):
         return self
 
     def next(self):
-        if len(self.__dictionary) != self.__size:
-            raise RuntimeError('dictionary changed size during iteration')
+        if self.__dictionary._layout != self.__layout:
+            raise RuntimeError('dictionary changed during iteration')
         else:
             return(next(self.__sequence))
 
@@ -59,26 +78,95 @@ class __dictionary_iterator(object):
     # prevents a user to add more attributes 
     # or reasign instance attributes.
     def __setattr__(self, name, value):
-        global _iter_counter, _iter_local_vars
-        
-        if _iter_counter < _iter_local_vars:
-            self.__dict__[name] = value
-            _iter_counter += 1
-        else:
-            cls = self.__class__.__name__
-            raise AttributeError("{} object has not attribute {}".format(cls, name))
+        cls = self.__class__.__name__
+        raise AttributeError("{} object has not attribute {}".format(cls, name))
 
 
 class _dictionary_keyiterator(__dictionary_iterator):
-    pass
+    __slots__ = ()
 
 
 class _dictionary_valueiterator(__dictionary_iterator):
-    pass
+    __slots__ = ()
 
 
 class _dictionary_itemiterator(__dictionary_iterator):
-    pass
+    __slots__ = ()
+
+
+# Masks a hash to an unsigned value of the size of a C size_t
+_SIZE_T_MASK = (1 << (8 * sizeof(c_size_t))) - 1
+_HALF_SIZE_T_BITS = 4 * sizeof(c_size_t)
+# The multipliers of the finalizer which mixes the seed into the hashes
+# when the flood protection is on
+_MIX_MULTIPLIERS = (0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53)
+# Spreads the bits of a hash before the bloom filter bits are picked from it
+_BLOOM_MULTIPLIER = 0x9E3779B97F4A7C15
+# The bytes taken by an entry tuple together with a full-width hash, and by
+# the dummy value left by a delete, used by Dictionary.memory_report
+_ENTRY_SIZE = getsizeof((0, 0, 0)) + getsizeof(1 << (8 * sizeof(c_size_t) - 2))
+_DUMMY_SIZE = getsizeof(_Dummy())
+# The default of pop when no default is given, so that any value, even a
+# false one, can be given as the default
+_MISSING = object()
+
+
+# Return the string used for obj in the reprs, strings are put in quotes
+def _repr_value(obj):
+    if type(obj) is str:
+        return "'" + obj + "'"
+    return str(obj)
+
+
+# Yields the parts of a repr: opening, the item strings separated by ', ' 
+# and closing. If max_items is given, the items after the first max_items
+# are replaced by '...'. Joining the parts takes linear time, and they can
+# be written to a stream one by one.
+def _repr_parts(opening, items, closing, max_items=None):
+    yield opening
+    for i, item in enumerate(items):
+        if i:
+            yield ', '
+        if i == max_items:
+            yield '...'
+            break
+        yield item
+    yield closing
+
+
+# A key together with its hash, for looking up the same key in many
+# dictionaries without hashing it again, see Dictionary.get_many
+class HashedKey(object):
+    __slots__ = ('key', 'hash')
+
+    def __init__(self, key):
+        self.key = key
+        self.hash = hash(key)
+
+    def __repr__(self):
+        return 'HashedKey({})'.format(_repr_value(self.key))
+
+
+# Used in place of anything which isn't a view of the same kind in the set
+# operations on the views. Sets are used as they are, anything else is 
+# turned into a set first, so the items only has to be iterated once.
+class _set_operand(object):
+    __slots__ = ('_items',)
+
+    def __init__(self, items):
+        if not isinstance(items, (set, frozenset)):
+            items = set(items)
+        self._items = items
+
+    def __len__(self):
+        return len(self._items)
+
+    def _hashed_items(self):
+        for item in self._items:
+            yield None, item
+
+    def _contains_hashed(self, item_hash, item):
+        return item in self._items
 
 
 class __dictionary_view(object):
@@ -87,11 +175,13 @@ class __dictionary_view(object):
     
     __metaclass__ = TypeReturn
 
+    __slots__ = ('_dictionary',)
+
+    # True if the hashes from _hashed_items are the hashes of the items
+    _item_hashes = False
+
     def __init__(self, dictionary):
-        global _view_counter, _view_local_vars
-        _view_counter = 0
-        _view_local_vars = 1
-        self._dictionary = dictionary
+        object.__setattr__(self, '_dictionary', dictionary)
         name = self.__class__.__name__
         self.__class__.__name__ = name[1:] if name.startswith('_') else name
 
@@ -99,99 +189,515 @@ class __dictionary_view(object):
         return len(self._dictionary)
 
     def __and__(self, other):
-        self_items = [item for item in self if item in other]
-        other_items = [item for item in other if item in self]
-        return set(self_items + other_items)
+        return {item for _, item in self._intersection(other)}
 
     def __rand__(self, other):
         return self & other
 
     def __or__(self, other):
-        self_items = [item for item in self]
-        other_items = [item for item in other]
-        return set(self_items + other_items)
+        items = set(self)
+        items.update(other)
+        return items
 
     def __ror__(self, other):
         return self | other
 
     def __sub__(self, other):
-        return {item for item in self if item not in other}
+        return {item for _, item in self._difference(other)}
 
     def __rsub__(self, other):
-        return {item for item in other if item not in self}
+        return {item for _, item in self._rdifference(other)}
 
     def __xor__(self, other):
-        self_items = [item for item in self if item not in other]
-        other_items = [item for item in other if item not in self]
-        return set(self_items + other_items)
+        other = self._operand(other)
+        items = {item for _, item in self._difference(other)}
+        items.update(item for _, item in self._rdifference(other))
+        return items
 
     def __rxor__(self, other):
         return self ^ other
 
+    def __le__(self, other):
+        if not self._is_set(other):
+            return NotImplemented
+        other = self._operand(other)
+        return len(self) <= len(other) and self._is_empty(self._difference(other))
+
+    def __ge__(self, other):
+        if not self._is_set(other):
+            return NotImplemented
+        other = self._operand(other)
+        return len(self) >= len(other) and self._is_empty(self._rdifference(other))
+
+    def isdisjoint(self, other):
+        """Return True if the view has no items in common with other."""
+        return self._is_empty(self._intersection(other))
+
+    def intersection(self, other):
+        """Same as view & other, but returns the keys view 
+           of a new dictionary instead of a set."""
+        return self._key_set(self._intersection(other))
+
+    def union(self, other):
+        """Same as view | other, but returns the keys view 
+           of a new dictionary instead of a set."""
+        other = self._operand(other)
+        return self._key_set(self._hashed_items(), other._hashed_items())
+
+    def difference(self, other):
+        """Same as view - other, but returns the keys view 
+           of a new dictionary instead of a set."""
+        return self._key_set(self._difference(other))
+
+    def symmetric_difference(self, other):
+        """Same as view ^ other, but returns the keys view 
+           of a new dictionary instead of a set."""
+        other = self._operand(other)
+        return self._key_set(self._difference(other), self._rdifference(other))
+
+    # Yields (hash, item) for the items in the view, where the hash is 
+    # the hash stored in the entry, or None if there's no hash to reuse
+    def _hashed_items(self):
+        for item in self:
+            yield None, item
+
+    # Same as item in view, but with the hash from _hashed_items
+    def _contains_hashed(self, item_hash, item):
+        return item in self
+
+    # A view of the same kind can be probed with the hashes 
+    # of this view, anything else is used as a set
+    def _operand(self, other):
+        if type(other) is type(self) or type(other) is _set_operand:
+            return other
+        return _set_operand(other)
+
+    # Inserts the items as keys in a new dictionary and returns the keys 
+    # view. The hashes are reused when they are the hashes of the items.
+    def _key_set(self, *hashed_items):
+        dictionary = Dictionary()
+        for items in hashed_items:
+            for item_hash, item in items:
+                if item_hash is None or not self._item_hashes:
+                    item_hash = hash(item)
+                dictionary.set_by_hash(item_hash, item, None)
+        return dictionary.keys()
+
+    # Yields the (hash, item) pairs of the items which are in both the view
+    # and other, by iterating over the smallest one and probing the other
+    def _intersection(self, other):
+        other = self._operand(other)
+        if len(other) < len(self):
+            return ((item_hash, item) for item_hash, item in other._hashed_items() 
+                    if self._contains_hashed(item_hash, item))
+        return ((item_hash, item) for item_hash, item in self._hashed_items()
+                if other._contains_hashed(item_hash, item))
+
+    # Yields the (hash, item) pairs of the items in the view not in other
+    def _difference(self, other):
+        other = self._operand(other)
+        return ((item_hash, item) for item_hash, item in self._hashed_items()
+                if not other._contains_hashed(item_hash, item))
+
+    # Yields the (hash, item) pairs of the items in other not in the view
+    def _rdifference(self, other):
+        other = self._operand(other)
+        return ((item_hash, item) for item_hash, item in other._hashed_items()
+                if not self._contains_hashed(item_hash, item))
+
+    @staticmethod
+    def _is_set(other):
+        return isinstance(other, (set, frozenset, _dictionary_keys, 
+                                  _dictionary_items))
+
+    @staticmethod
+    def _is_empty(iterable):
+        for _ in iterable:
+            return False
+        return True
+
     def __setattr__(self, name, value):
-        global _view_counter, _view_local_vars
-        
-        if _view_counter < _view_local_vars:
-            self.__dict__[name] = value
-            _view_counter += 1
-        else:
-            cls = self.__class__.__name__
-            raise AttributeError("{} object has not attribute {}".format(cls, name))
+        cls = self.__class__.__name__
+        raise AttributeError("{} object has not attribute {}".format(cls, name))
+
+    def __repr__(self):
+        return self.format_repr()
+
+    def format_repr(self, max_items=None):
+        """Return the repr of the view. If max_items is given, only the 
+           first max_items items are included."""
+        return ''.join(self._repr_parts(max_items))
+
+    def write_repr(self, stream, max_items=None):
+        """Write the repr of the view to stream, one item at a time."""
+        stream.writelines(self._repr_parts(max_items))
+
+    def _repr_parts(self, max_items):
+        cls = self.__class__.__name__
+        return _repr_parts(cls + '([', self._repr_items(), '])', max_items)
+
+    # layout is the dictionary's _layout when the iteration started
+    def _runtime_check(self, layout):
+        if layout != self._dictionary._layout:
+            raise RuntimeError('dictionary changed during iteration')
 
 class _dictionary_keys(__dictionary_view):
+    __slots__ = ()
+
+    _item_hashes = True
+
+    def __contains__(self, key):
+        return key in self._dictionary
+
+    def _hashed_items(self):
+        layout = self._dictionary._layout
+        for key_hash, key, _ in self._dictionary._get_key_entries():
+            self._runtime_check(layout)
+            yield key_hash, key
+
+    def _contains_hashed(self, key_hash, key):
+        return self._dictionary._contains_key(key, key_hash)
+
     def __iter__(self):
         for key in self._dictionary.iterkeys():
             yield key
 
-    def __repr__(self):
-        cls = self.__class__.__name__
-        keys = ''
-        for key in self:
-            if type(key) is str:
-                key = "'" + key + "'"
-            keys += '%s, ' % key
-        return '{}([{}])'.format(cls, keys[:-2])
+    def _repr_items(self):
+        return (_repr_value(key) for key in self)
 
 
 class _dictionary_values(__dictionary_view):
+    __slots__ = ()
+
     def __iter__(self):
         for value in self._dictionary.itervalues():
             yield value
 
-    def __repr__(self):
-        cls = self.__class__.__name__
-        values = ''
-        for value in self:
-            if type(value) is str:
-                value = "'" + value + "'"
-            values += '%s, ' % value
-        return '{}([{}])'.format(cls, values[:-2])
+    def _repr_items(self):
+        return (_repr_value(value) for value in self)
         
 
 class _dictionary_items(__dictionary_view):
+    __slots__ = ()
+
+    def __contains__(self, item):
+        return self._contains_hashed(None, item)
+
+    def _hashed_items(self):
+        layout = self._dictionary._layout
+        for key_hash, key, value in self._dictionary._get_entries():
+            self._runtime_check(layout)
+            yield key_hash, (key, value)
+
+    # The hash is the hash of the key, not the (key, value) pair
+    def _contains_hashed(self, key_hash, item):
+        if type(item) is not tuple or len(item) != 2:
+            return False
+        key, value = item
+        entry = self._dictionary._lookup(key, key_hash)
+        return entry is not None and entry[2] == value
+
     def __iter__(self):
         for key, value in self._dictionary.iteritems():
             yield key, value
             
-    def __repr__(self):
-        cls = self.__class__.__name__
-        items = ''
-        for key, value in self:
-            if type(key) is str:
-                key = "'" + key + "'"
-            if type(value) is str:
-                value = "'" + value + "'"
-            items += '(%s, %s), ' % (key, value)
-        return '{}([{}])'.format(cls, items[:-2])
+    def _repr_items(self):
+        return ('({}, {})'.format(_repr_value(key), _repr_value(value))
+                for key, value in self)
+
+
+# The size of the small tables, and the smallest entry table
+_BASE_SIZE = 8
+
+
+class ResizePolicy(object):
+    """Decides when the entry table of a Dictionary is resized, and to which
+       size. The table grows by growth when max_load of its slots are used, 
+       or by large_growth once it holds large_len items, and it's shrunk to 
+       fit the items when fewer than shrink_load of its slots are used. 
+       Keeping shrink_load well below max_load / growth makes a gap between
+       the two, so a dictionary whose size goes up and down around a 
+       boundary isn't resized every time. Entry tables, except small ones,
+       have at least min_size slots.
+       
+       grows, shrinks and cleanups count the resizes the policy has caused,
+       in all the dictionaries it's used by. A cleanup rebuilds the table at 
+       the same size to get rid of dummy values."""
+
+    __slots__ = ('growth', 'large_growth', 'large_len', 'max_load', 
+                 'shrink_load', 'min_size', 'grows', 'shrinks', 'cleanups')
+
+    def __init__(self, growth=4, large_growth=2, large_len=50000,
+                 max_load=2.0/3.0, shrink_load=1.0/12.0, min_size=_BASE_SIZE):
+        for factor in (growth, large_growth):
+            if factor < 2 or factor & (factor - 1):
+                raise ValueError('growth and large_growth must be powers of 2')
+        if not 0 < max_load < 1 or not 0 <= shrink_load < max_load:
+            raise ValueError('max_load must be between 0 and 1, and '
+                             'shrink_load between 0 and max_load')
+        
+        self.growth = growth
+        self.large_growth = large_growth
+        self.large_len = large_len
+        self.max_load = max_load
+        self.shrink_load = shrink_load
+        self.min_size = min_size
+        self.grows = 0
+        self.shrinks = 0
+        self.cleanups = 0
+
+    @classmethod
+    def memory(cls):
+        """A policy for small memory use, with dense tables which grow by 
+           2 and are shrunk once three quarters of them are free."""
+        return cls(growth=2, large_growth=2, max_load=0.75, shrink_load=0.25)
+
+    @classmethod
+    def latency(cls):
+        """A policy for fast lookups, with sparse tables which grow by 4 and
+           are rarely shrunk, so probes are short and resizes are few."""
+        return cls(growth=4, large_growth=4, max_load=0.5, shrink_load=1.0/32)
+
+    @classmethod
+    def throughput(cls):
+        """A policy for bulk loads and churn, with tables which start at 1024
+           slots, grow by 4 and are never shrunk."""
+        return cls(growth=4, large_growth=4, shrink_load=0, min_size=1024)
+
+    def size_for(self, n):
+        """Return the size of an entry table for n items"""
+        size = _BASE_SIZE
+        if n < size:
+            return size
+        while n >= size * self.max_load or size < self.min_size:
+            size *= self.growth if n < self.large_len else self.large_growth
+        return size
+
+    def grown_size(self, size, n):
+        """Return the size a full entry table of size slots with n items 
+           grows to"""
+        factor = self.growth if n < self.large_len else self.large_growth
+        size *= factor
+        while n >= size * self.max_load or size < self.min_size:
+            size *= factor
+        return size
+
+    def stats(self):
+        """Return a dictionary with the number of grows, shrinks and cleanups
+           the policy has caused"""
+        return Dictionary(grows=self.grows, shrinks=self.shrinks,
+                          cleanups=self.cleanups)
+
+
+# Shared by the dictionaries which haven't been resized yet, so they don't
+# each allocate a policy. A dictionary gets its own ResizePolicy to count its
+# resizes when it's first resized, or when its resize_policy is asked for.
+_DEFAULT_RESIZE_POLICY = ResizePolicy()
+
+
+class AdaptiveResizePolicy(ResizePolicy):
+    """A ResizePolicy which tunes max_load and growth to the workload of the
+       dictionary using it, every time the entry table grows or is cleaned
+       up. It counts the hits, misses and deletes since the last resize, and
+       the dictionary gives it a sample of the probe lengths in the table.
+       
+       max_load moves by step within load_bounds. The table gets sparser 
+       when most lookups miss, probes get long or many of the inserted keys
+       are deleted again, and denser when lookups hit after short probes.
+       growth is doubled, up to growth_bounds[1], when there have been more
+       inserts than lookups, and halved, down to growth_bounds[0], when not.
+       
+       The counters describe a single dictionary, so an adaptive policy 
+       shouldn't be shared."""
+
+    __slots__ = ('load_bounds', 'growth_bounds', 'step', 'hits', 'misses',
+                 'deletes', 'last_len', 'adjustments', 'probe_length',
+                 'miss_ratio', 'delete_rate')
+
+    def __init__(self, load_bounds=(0.4, 0.8), growth_bounds=(2, 8), 
+                 step=0.05, **kwargs):
+        ResizePolicy.__init__(self, **kwargs)
+        low, high = load_bounds
+        if not self.shrink_load < low <= self.max_load <= high < 1:
+            raise ValueError('load_bounds must be between shrink_load and 1, '
+                             'and around max_load')
+        low, high = growth_bounds
+        if low < 2 or low & (low - 1) or high & (high - 1) or \
+           not low <= self.growth <= high:
+            raise ValueError('growth_bounds must be powers of 2 around growth')
+        
+        self.load_bounds = load_bounds
+        self.growth_bounds = growth_bounds
+        self.step = step
+        self.large_growth = self.growth
+        self.hits = 0
+        self.misses = 0
+        self.deletes = 0
+        self.last_len = 0
+        self.adjustments = 0
+        self.probe_length = None
+        self.miss_ratio = None
+        self.delete_rate = None
+
+    def adjust(self, n, probe_lengths):
+        """Tune max_load and growth from what has been seen since the last
+           resize, for a table with n items where probe_lengths is a sample 
+           of the probe lengths of its entries. Called by the dictionary."""
+        lookups = self.hits + self.misses
+        inserts = max(n - self.last_len + self.deletes, 1)
+        self.probe_length = (float(sum(probe_lengths)) / len(probe_lengths)
+                             if probe_lengths else 1.0)
+        self.miss_ratio = float(self.misses) / lookups if lookups else 0.0
+        self.delete_rate = float(self.deletes) / inserts
+        
+        max_load = self.max_load
+        if (self.miss_ratio > 0.5 or self.probe_length > 2.0 or 
+            self.delete_rate > 0.5):
+            max_load -= self.step
+        elif self.miss_ratio < 0.1 and self.probe_length < 1.5:
+            max_load += self.step
+        low, high = self.load_bounds
+        max_load = min(max(max_load, low), high)
+        
+        low, high = self.growth_bounds
+        if inserts > lookups:
+            growth = min(self.growth * 2, high)
+        else:
+            growth = max(self.growth // 2, low)
+        
+        if max_load != self.max_load or growth != self.growth:
+            self.adjustments += 1
+        self.max_load = max_load
+        self.growth = self.large_growth = growth
+        self.hits = self.misses = self.deletes = 0
+        self.last_len = n
+
+    def stats(self):
+        """Return a dictionary with the number of grows, shrinks, cleanups
+           and adjustments, the current max_load and growth, and the probe 
+           length, miss ratio and delete rate seen at the last adjustment"""
+        stats = ResizePolicy.stats(self)
+        stats.update(adjustments=self.adjustments, max_load=self.max_load,
+                     growth=self.growth, probe_length=self.probe_length,
+                     miss_ratio=self.miss_ratio, delete_rate=self.delete_rate)
+        return stats
+
+
+# The lock of a dictionary with lock stats enabled, an RLock which counts
+# the acquisitions and the time spent waiting for it, and keeps histograms
+# of the time it's held. Only the outermost acquire and release of the 
+# owning thread are counted, and the counters are only changed while the 
+# lock is held. Bucket i of a histogram counts the holds shorter than 2**i
+# microseconds, the last bucket also counts the longer ones.
+class _InstrumentedLock(object):
+    
+    __BUCKETS = 21
+
+    __slots__ = ('__lock', '__depth', '__held_since', 'resizing',
+                 'acquisitions', 'contended', 'wait_time', 'max_wait',
+                 'hold_time', 'holds', 'resize_time', 'resize_holds')
+
+    def __init__(self):
+        self.__lock = RLock()
+        self.__depth = 0
+        self.__held_since = 0.0
+        # Set by the dictionary when it rebuilds the entry table, so the
+        # hold is counted as a resize
+        self.resizing = False
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.hold_time = 0.0
+        self.holds = [0] * self.__BUCKETS
+        self.resize_time = 0.0
+        self.resize_holds = [0] * self.__BUCKETS
+
+    def acquire(self, blocking=True):
+        wait = None
+        if not self.__lock.acquire(False):
+            if not blocking:
+                return False
+            start = _clock()
+            self.__lock.acquire()
+            wait = _clock() - start
+        
+        self.__depth += 1
+        if self.__depth == 1:
+            self.acquisitions += 1
+            if wait is not None:
+                self.contended += 1
+                self.wait_time += wait
+                self.max_wait = max(self.max_wait, wait)
+            self.__held_since = _clock()
+        return True
+
+    def release(self):
+        if not self.__depth:
+            raise RuntimeError('cannot release un-acquired lock')
+        self.__depth -= 1
+        if not self.__depth:
+            held = _clock() - self.__held_since
+            bucket = min(int(held * 1e6).bit_length(), self.__BUCKETS - 1)
+            if self.resizing:
+                self.resizing = False
+                self.resize_time += held
+                self.resize_holds[bucket] += 1
+            else:
+                self.hold_time += held
+                self.holds[bucket] += 1
+        self.__lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def stats(self):
+        def histogram(buckets):
+            return Dictionary((1 << i, count) for i, count in enumerate(buckets)
+                              if count)
+        return Dictionary(acquisitions=self.acquisitions, 
+                          contended=self.contended, wait_time=self.wait_time,
+                          max_wait=self.max_wait, hold_time=self.hold_time,
+                          holds=histogram(self.holds), 
+                          resizes=sum(self.resize_holds),
+                          resize_time=self.resize_time,
+                          resize_holds=histogram(self.resize_holds))
 
 
 class Dictionary(object):
+
+    __metaclass__ = _SlotNames
     
-    __BASE_SIZE = 8
+    __BASE_SIZE = _BASE_SIZE
+
+    __slots__ = ('lock', '__len', '__true_len', '__size', '__entries',
+                 '__small', '__fingerprint', '__bloom', '__bloom_on',
+                 '__resize_policy', '__grow_at', '__shrink_at',
+                 '__tuning', '__seed', '__max_probes', '__flooded',
+                 '__reseeds', '__reseeded_size', '__front', '__front_mask',
+                 '__front_hits', '__front_misses', '__version', '_layout',
+                 '__lock_stats')
+
+    # False in subclasses which wrap the values, since the fingerprint
+    # would be of the wrapped values
+    _fingerprints = True
     
     # Sequence must be either another dictionary or
     # a sequece of key-value pairs so self[key] = value
     def __init__(self, sequence=None, **kwargs):
+        self.__fingerprint = None
+        self.__bloom_on = False
+        self.__resize_policy = _DEFAULT_RESIZE_POLICY
+        self.__tuning = None
+        self.__seed = None
+        self.__max_probes = None
+        self.__reseeds = 0
+        self.__front = None
+        self.__version = 0
+        self._layout = 0
+        self.__lock_stats = None
         self.clear()
         if sequence or kwargs:
             self.update(sequence, **kwargs)
@@ -200,6 +706,23 @@ class Dictionary(object):
     def debug(self):
         return self.__entries
 
+    @property
+    def version(self):
+        """A number which grows every time the dictionary is changed, so a
+           result computed from the items is still valid as long as the 
+           version is the same"""
+        return self.__version
+
+    @property
+    def resize_policy(self):
+        """The ResizePolicy which decides when the entry table is resized"""
+        return self.__counting_policy()
+
+    @property
+    def fingerprint(self):
+        """The fingerprint of the items, or None if it's not tracked"""
+        return self.__fingerprint
+
     @classmethod
     def fromkeys(cls, seq, value=None):
         """Create a new dictionary with keys from seq and 
@@ -209,47 +732,76 @@ class Dictionary(object):
             new_dict[key] = value
         return new_dict
     
+    @classmethod
+    def group_by(cls, iterable, keyfunc):
+        """Create a new dictionary which maps keyfunc(item) to a list of the
+           items in iterable with that key, in the order they came in."""
+        new_dict = cls()
+        for item in iterable:
+            new_dict.get_or_insert(keyfunc(item), list).append(item)
+        return new_dict
+
+    @classmethod
+    def build_parallel(cls, iterable, workers=None, chunk_size=10000):
+        """Create a new dictionary from iterable, a mapping or an iterable of
+           key/value pairs, where the keys are hashed by a pool of worker 
+           processes, multiprocessing.cpu_count() by default, chunk_size pairs at a time.
+           The pairs are inserted in order with the hashes from the workers,
+           so later pairs win as usual.
+           
+           The keys and values must be picklable. It pays off when hashing 
+           the keys is expensive, like for long strings or tuples of them.
+           Only the hashes of str, unicode, int and long keys, and tuples of 
+           these, are taken from the workers; other keys, whose hash may be
+           different in another process, are hashed again in this process.
+           If the workers hash strings differently, which happens when they
+           are spawned rather than forked and PYTHONHASHSEED isn't set, the
+           dictionary is built in this process instead.
+           
+           If iterable has a length, the entry table is sized for it up 
+           front, and when it's shorter than chunk_size no pool is started."""
+        if hasattr(iterable, 'keys'):
+            iterable = iterable.items()
+        
+        new_dict = cls()
+        if hasattr(iterable, '__len__'):
+            if len(iterable) < chunk_size:
+                new_dict.update(iterable)
+                return new_dict
+            new_dict._reserve(len(iterable))
+        
+        pool = Pool(workers)
+        try:
+            if pool.apply(hash, ('build_parallel',)) != hash('build_parallel'):
+                new_dict.update(iterable)
+                return new_dict
+            for entries in pool.imap(_hash_pairs, _chunks(iterable, chunk_size)):
+                new_dict._insert_entries(
+                    (hash(key) if key_hash is None else key_hash, key, value)
+                    for key_hash, key, value in entries)
+        finally:
+            pool.terminate()
+            pool.join()
+        return new_dict
+
     def __len__(self):
         """Return the number of items in the dictionary."""
         return self.__len
     
     def __contains__(self, key):
         """Return true if dictionary has key else false."""
-        index = self.__get_index(key)
-        return self.__valid_entry(self.__entries[index])
+        return self.__find(key, hash(key)) is not None
          
-    # The default argument 'shrink' is used internally to prevent recursive 
-    # shrinking when inserting entries into the entry table after 
-    # resizing/shrinking the entry table
-    def __setitem__(self, key, value, shrink=True):
+    def __setitem__(self, key, value):
         """Set dictionary[key] to value."""
-        self.lock.acquire()
-        index = self.__get_index(key)
-        entry = self.__entries[index]
-
-        if entry is None:
-            self.__len += 1    
-            self.__true_len += 1
-        elif type(entry) is _Dummy:
-            self.__len += 1
-        
-        self.__entries[index] = (hash(key), key, value) 
-        
-        if self.__true_len >= (len(self.__entries) * (2.0/3.0)):
-            self.__resize()    
-        elif shrink:
-            if len(self) < self.__prev_size * (2.0/3.0) and self.__size > self.__BASE_SIZE:
-                self.__shrink()
-        
-        self.lock.release()
+        self.__insert(key, hash(key), value)
     
     def __getitem__(self, key):
         """Return the item of dictionary with key 'key'.
            Raises a KeyError if key is not in the map."""
-        index = self.__get_index(key)
-        entry = self.__entries[index]
+        entry = self.__find(key, hash(key))
         
-        if self.__valid_entry(entry):
+        if entry is not None:
             _, _, value = entry
             return value
         else:
@@ -266,7 +818,20 @@ class Dictionary(object):
         
         if self.__valid_entry(entry):
             self.__len -= 1
-            self.__entries[index] = _Dummy()
+            self.__version += 1
+            self._layout += 1
+            if self.__fingerprint is not None:
+                self.__update_fingerprint(entry, None)
+            if self.__tuning is not None:
+                self.__tuning.deletes += 1
+            if self.__small:
+                # Keeps the small table packed by moving the last entry 
+                # into the freed slot instead of leaving a dummy value
+                self.__true_len -= 1
+                self.__entries[index] = self.__entries[self.__len]
+                self.__entries[self.__len] = None
+            else:
+                self.__entries[index] = _Dummy()
             self.lock.release()
         else:
             self.lock.release()
@@ -277,19 +842,12 @@ class Dictionary(object):
     def __getattr__(self, key):
         return self[key]
     
-    # checks if all instance variables have been initialized,
-    # inserts them into the instance dictionry if not, or if
-    # changing the value of an instance variable
-    # else call __setitem__
-    # dictionary.key = value, same as dictonary[key] = value
+    # The instance state lives in __slots__, so a name in _slot_names is an
+    # instance variable, anything else is a key.
+    # dictionary.key = value, same as dictonary[key] = value.
     def __setattr__(self, name, value):
-        global _dict_counter, _dict_local_vars
-        
-        if name in self.__dict__:
-            self.__dict__[name] = value
-        elif _dict_counter < _dict_local_vars:
-            self.__dict__[name] = value
-            _dict_counter += 1
+        if name in self._slot_names:
+            object.__setattr__(self, name, value)
         else:
             self[name] = value
     
@@ -305,40 +863,257 @@ class Dictionary(object):
     # Not a proper repr, but returns a string so it looks like 
     # pythons built-in dictionary
     def __repr__(self):
-        items = ''
-        for _, key, value in self.__get_entries():
-            if type(key) is str:
-                key = "'" + key + "'"
-            if type(value) is str:
-                value = "'" + value + "'"
-            items += str(key) + ': ' + str(value) + ', '
+        return self.format_repr()
+
+    def format_repr(self, max_items=None):
+        """Return the repr of the dictionary. If max_items is given, only 
+           the first max_items items are included."""
+        return ''.join(self.__repr_parts(max_items))
 
-        return '{' +  items[:-2] + '}'
+    def write_repr(self, stream, max_items=None):
+        """Write the repr of the dictionary to stream, one item at a time,
+           so even huge dictionaries can be written to a file."""
+        stream.writelines(self.__repr_parts(max_items))
 
+    # Compares the lengths first, then probes other with the hash stored in
+    # each entry. If both dictionaries track their fingerprints, different
+    # fingerprints means they can't be equal.
     def __eq__(self, other):
-        type_other = type(other)
-        if type_other is Dictionary or type_other is dict:
-            dicts = izip(self, other)
-            return all(key1==key2 and self[key1]==other[key2] 
-                       for key1, key2 in dicts)
-        else:
+        if isinstance(other, (SpillDictionary, TTLDictionary)):
+            return other == self
+        elif isinstance(other, dict):
+            return len(self) == len(other) and all(
+                key in other and other[key] == value 
+                for _, key, value in self._get_entries())
+        elif not isinstance(other, Dictionary) or len(self) != len(other):
+            return False
+        elif None not in (self.__fingerprint, other.__fingerprint) and \
+                self.__fingerprint != other.__fingerprint:
             return False
+        
+        for key_hash, key, value in self._get_entries():
+            entry = other._lookup(key, key_hash)
+            if entry is None or not entry[2] == value:
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self == other
     
     def __hash__(self):
         cls = self.__class__.__name__
         raise TypeError("unhashable type: '{}'".format(cls))
 
+    # Like the built-in containers, the keys and values aren't included
+    def __sizeof__(self):
+        return sum(self.__structure_sizes())
+
     def clear(self):
         """Remove all items from the dictionary"""
-        global _dict_counter, _dict_local_vars
-        _dict_counter = 0
-        _dict_local_vars = 6
-        self.lock = RLock()
+        if self.__lock_stats is None:
+            self.lock = RLock()
         self.__len = 0
         self.__true_len = 0
         self.__size = self.__BASE_SIZE
-        self.__prev_size = self.__size
         self.__entries = [None] * self.__size
+        self.__small = True
+        self.__set_thresholds()
+        self.__bloom = None
+        self.__flooded = False
+        self.__reseeded_size = 0
+        self.__reset_front_cache()
+        self.__version += 1
+        self._layout += 1
+        if self.__fingerprint is not None:
+            self.__fingerprint = 0
+
+    def track_fingerprint(self):
+        """Keep an order-independent fingerprint of the items, which is updated
+           on every insert and delete. Two dictionaries with different 
+           fingerprints are never equal, so == can tell that in O(1).
+           Raises a TypeError if a value isn't hashable. The fingerprint 
+           stops being tracked if an unhashable value is inserted later."""
+        if not self._fingerprints:
+            cls = self.__class__.__name__
+            raise TypeError("'{}' doesn't support fingerprints".format(cls))
+        
+        self.lock.acquire()
+        try:
+            fingerprint = 0
+            for entry in Dictionary._get_entries(self):
+                fingerprint ^= self.__entry_fingerprint(entry)
+            self.__fingerprint = fingerprint
+        finally:
+            self.lock.release()
+
+    def set_resize_policy(self, policy):
+        """Let policy, a ResizePolicy, decide when the entry table is resized
+           from now on. The entry table is resized to fit the policy at once.
+           An AdaptiveResizePolicy also gets the hits, misses and deletes."""
+        self.lock.acquire()
+        try:
+            self.__resize_policy = policy
+            adaptive = isinstance(policy, AdaptiveResizePolicy)
+            self.__tuning = policy if adaptive else None
+            self._compact()
+        finally:
+            self.lock.release()
+
+    def enable_flood_protection(self, max_probes=16):
+        """Mix the hashes with a random secret seed before probing, so keys
+           whose hashes only differ in the high bits, like multiples of a 
+           large power of two, don't follow the same probe sequence. When a
+           lookup probes more than max_probes slots, the dictionary picks a
+           new seed and rebuilds the table on the next insert, at most once
+           per table size.
+           
+           It doesn't bound the cost of keys with equal hashes, which collide
+           whatever the seed is: a lookup among n of them still probes O(n)
+           slots, and ints make them easy to craft, like 1 + i * (2**61 - 1)
+           on 64-bit builds. Long probe sequences made of such keys don't 
+           make the dictionary pick a new seed."""
+        self.lock.acquire()
+        try:
+            self.__max_probes = max_probes
+            self.__seed = SystemRandom().getrandbits(8 * sizeof(c_size_t))
+            self._compact()
+        finally:
+            self.lock.release()
+
+    def disable_flood_protection(self):
+        """Go back to probing with the plain hashes"""
+        self.lock.acquire()
+        try:
+            self.__max_probes = None
+            self.__seed = None
+            self._compact()
+        finally:
+            self.lock.release()
+
+    def flood_stats(self):
+        """Return None if the flood protection is off, else a dictionary with
+           max_probes and the number of times a new seed has been picked"""
+        if self.__seed is None:
+            return None
+        return Dictionary(max_probes=self.__max_probes, reseeds=self.__reseeds)
+
+    def enable_front_cache(self, size=256):
+        """Remember the slots of recently found keys in a direct-mapped cache
+           with size places, indexed by the low bits of the hash, which is 
+           checked before probing. A key found there costs one comparison
+           with the entry in its slot, so a few hot keys are looked up fast.
+           size must be a power of 2."""
+        if size < 1 or size & (size - 1):
+            raise ValueError('size must be a power of 2')
+        self.__front = [0] * size
+        self.__front_mask = size - 1
+        self.__front_hits = 0
+        self.__front_misses = 0
+
+    def disable_front_cache(self):
+        """Stop using the front cache and free it"""
+        self.__front = None
+
+    def front_cache_stats(self):
+        """Return None if there's no front cache, else a dictionary with its 
+           size and the number of hits and misses since it was enabled"""
+        if self.__front is None:
+            return None
+        return Dictionary(size=len(self.__front), hits=self.__front_hits,
+                          misses=self.__front_misses)
+
+    def enable_lock_stats(self):
+        """Replace the lock with one which counts the acquisitions, the 
+           acquisitions which had to wait for another thread and the time
+           spent waiting, and keeps a histogram of the time it's held. The
+           holds which resized or rebuilt the entry table are kept apart 
+           from the other writes. Reads don't take the lock, so they aren't
+           counted. Must be called before other threads use the dictionary."""
+        self.__lock_stats = _InstrumentedLock()
+        self.lock = self.__lock_stats
+
+    def disable_lock_stats(self):
+        """Go back to a plain lock, also while no other thread uses the 
+           dictionary"""
+        self.__lock_stats = None
+        self.lock = RLock()
+
+    def lock_stats(self):
+        """Return None if the lock stats are off, else a dictionary with the
+           number of acquisitions, the number of them which had to wait, the
+           total and longest wait, the total time held and a histogram of
+           the hold times, and the same for the resizes. A histogram maps 
+           2**i microseconds to the number of holds shorter than that and
+           at least half as long, the longest bucket also has the longer 
+           ones. Times are in seconds."""
+        if self.__lock_stats is None:
+            return None
+        return self.__lock_stats.stats()
+
+    def enable_bloom_filter(self):
+        """Keep a bloom filter of the hashes of the keys, which is checked
+           before probing, so most lookups of missing keys return without
+           touching the entry table. Takes one byte per slot. Small tables
+           don't use it, since they are scanned without probing."""
+        self.__bloom_on = True
+        self.rebuild_bloom_filter()
+
+    def disable_bloom_filter(self):
+        """Stop keeping the bloom filter and free it"""
+        self.__bloom_on = False
+        self.__bloom = None
+
+    def rebuild_bloom_filter(self):
+        """Rebuild the bloom filter from the keys in the dictionary. Deleted
+           keys stay in the filter until it's rebuilt, which happens on
+           every resize, so call this after deleting many keys to get rid
+           of the false positives they cause."""
+        self.lock.acquire()
+        try:
+            if self.__bloom_on and not self.__small:
+                self.__bloom = bytearray(self.__size)
+                for key_hash, _, _ in Dictionary._get_entries(self):
+                    self.__bloom_add(key_hash)
+            else:
+                self.__bloom = None
+        finally:
+            self.lock.release()
+
+    def memory_report(self, deep=False, sample=64):
+        """Return a dictionary with the bytes used by the entry table, the 
+           entry tuples with their hashes, the dummy values left by deletes
+           (tombstones), the keys, the values, the auxiliary structures like 
+           the lock, the bloom filter and the front cache, and their total.
+           All but the keys and values are computed from the counters. The
+           keys and values are measured for the first sample entries and 
+           scaled up to all of them, or for all entries if sample is None.
+           If deep is true, the values include the objects in containers.
+           The links or records in which the subclasses wrap the values are
+           counted with the auxiliary structures."""
+        self.lock.acquire()
+        try:
+            table, entries, tombstones, auxiliary = self.__structure_sizes()
+            measured = list(islice(Dictionary._get_entries(self), sample))
+            unwrapped = list(self._unwrap_entries(measured))
+            value_size = _deep_sizeof if deep else getsizeof
+            keys = sum(getsizeof(key) for _, key, _ in measured)
+            values = sum(value_size(value) for _, _, value in unwrapped)
+            wrappers = 0
+            if type(self)._unwrap_entries != Dictionary._unwrap_entries:
+                wrappers = sum(getsizeof(wrapper) for _, _, wrapper in measured)
+            if measured:
+                keys = keys * self.__len // len(measured)
+                wrappers = wrappers * self.__len // len(measured)
+            if unwrapped:
+                values = values * self.__len // len(unwrapped)
+            auxiliary += wrappers
+        finally:
+            self.lock.release()
+        
+        total = table + entries + tombstones + keys + values + auxiliary
+        return Dictionary(table=table, entries=entries, tombstones=tombstones,
+                          keys=keys, values=values, auxiliary=auxiliary,
+                          total=total)
 
     def copy(self):
         """Return a shallow copy of the dictionary"""
@@ -393,11 +1168,190 @@ class Dictionary(object):
     def setdefault(self, key, default=None):
         """If the key is in the dictionary, return its value. If not, insert key
            with a value of default and return default. Default defaults to None."""
+        return self.__get_or_insert(key, default, None)
+
+    def get_by_hash(self, key_hash, key, default=None):
+        """Same as get(key, default), but with the hash of key given as 
+           key_hash so it's not calculated again. key_hash must be hash(key)."""
+        entry = self.__find(key, key_hash)
+        return default if entry is None else entry[2]
+
+    def set_by_hash(self, key_hash, key, value):
+        """Same as dictionary[key] = value, but with the hash of key given as
+           key_hash so it's not calculated again. key_hash must be hash(key)."""
+        self.__insert(key, key_hash, value)
+
+    def get_many(self, hashed_keys, default=None):
+        """Return a list with the value of each HashedKey in hashed_keys, 
+           or default for the keys not in the dictionary."""
+        get_by_hash = self.get_by_hash
+        return [get_by_hash(hashed_key.hash, hashed_key.key, default) 
+                for hashed_key in hashed_keys]
+
+    def set_many(self, hashed_items):
+        """Set dictionary[key] = value for each (HashedKey, value) pair
+           in hashed_items."""
+        self.lock.acquire()
         try:
-            return self[key]
-        except KeyError:
-            self[key] = default
+            for hashed_key, value in hashed_items:
+                self.set_by_hash(hashed_key.hash, hashed_key.key, value)
+        finally:
+            self.lock.release()
+
+    def get_or_insert(self, key, factory):
+        """If the key is in the dictionary, return its value. If not, insert key
+           with a value of factory() and return that value."""
+        return self.__get_or_insert(key, None, factory)
+
+    def upsert(self, key, fn, default=None):
+        """Set dictionary[key] to fn(dictionary[key]), or to fn(default) if key
+           is not in the dictionary. Return the new value.
+           fn must not modify the dictionary."""
+        key_hash = hash(key)
+        self.lock.acquire()
+        try:
+            index = self.__get_index(key, key_hash)
+            entry = self.__entries[index]
+            value = fn(entry[2] if self.__valid_entry(entry) else default)
+            self.__store(index, key, key_hash, value)
+            return value
+        finally:
+            self.lock.release()
+
+    def increment(self, key, delta=1):
+        """Add delta to dictionary[key], where a key which is not in the
+           dictionary counts as 0. Return the new value."""
+        key_hash = hash(key)
+        self.lock.acquire()
+        try:
+            index = self.__get_index(key, key_hash)
+            entry = self.__entries[index]
+            value = entry[2] + delta if self.__valid_entry(entry) else delta
+            self.__store(index, key, key_hash, value)
+            return value
+        finally:
+            self.lock.release()
+
+    def pop_if(self, key, pred, default=None):
+        """If the key is in the dictionary and pred(dictionary[key]) is true,
+           remove it and return its value, else return default.
+           pred must not modify the dictionary."""
+        self.lock.acquire()
+        try:
+            index = self.__get_index(key)
+            entry = self.__entries[index]
+            if self.__valid_entry(entry) and pred(entry[2]):
+                Dictionary.__delitem__(self, key, index)
+                return entry[2]
             return default
+        finally:
+            self.lock.release()
+
+    def delete_where(self, pred):
+        """Remove every item for which pred(key, value) is true in a single
+           pass, then compact the entry table once. Return the number of
+           removed items. pred must not modify the dictionary."""
+        self.lock.acquire()
+        try:
+            kept = []
+            matched = []
+            for entry in Dictionary._get_entries(self):
+                if pred(entry[1], entry[2]):
+                    matched.append(entry)
+                else:
+                    kept.append(entry)
+            removed = len(matched)
+            if removed:
+                self.__version += 1
+                if self.__fingerprint is not None:
+                    for entry in matched:
+                        self.__update_fingerprint(entry, None)
+                self.__size = self.__resize_policy.size_for(len(kept))
+                self.__rebuild(kept)
+            return removed
+        finally:
+            self.lock.release()
+
+    def retain(self, pred):
+        """Keep only the items for which pred(key, value) is true, the
+           opposite of delete_where. Return the number of removed items."""
+        return self.delete_where(lambda key, value: not pred(key, value))
+
+    def delete_many(self, keys):
+        """Remove the keys in keys which are in the dictionary, skipping the
+           ones which aren't, then compact the entry table once. Return the
+           number of removed keys."""
+        self.lock.acquire()
+        try:
+            removed = 0
+            for key in keys:
+                index = self.__get_index(key)
+                if self.__valid_entry(self.__entries[index]):
+                    Dictionary.__delitem__(self, key, index)
+                    removed += 1
+            if removed:
+                self._compact()
+            return removed
+        finally:
+            self.lock.release()
+
+    def map_values(self, fn, executor=None, chunk_size=4096):
+        """Replace every value with fn(value). The entry table is split into
+           ranges of chunk_size slots, which are mapped by executor if given,
+           a concurrent.futures executor or a multiprocessing pool, and the 
+           new values are written back in one pass once all of them have 
+           been computed, so the dictionary is left unchanged if fn raises.
+           The lock is held throughout, and fn must not modify the 
+           dictionary."""
+        mapper = map if executor is None else executor.map
+        self.lock.acquire()
+        try:
+            entries = self.__entries
+            starts = range(0, len(entries), chunk_size)
+            chunks = [[entry[2] for entry in entries[start:start + chunk_size]
+                       if self.__valid_entry(entry)] for start in starts]
+            results = list(mapper(partial(_map_values, fn), chunks))
+            
+            for start, values in izip(starts, results):
+                values = iter(values)
+                for index in range(start, min(start + chunk_size, len(entries))):
+                    entry = entries[index]
+                    if self.__valid_entry(entry):
+                        new_entry = (entry[0], entry[1], next(values))
+                        if self.__fingerprint is not None:
+                            self.__update_fingerprint(entry, new_entry)
+                        entries[index] = new_entry
+            self.__version += 1
+        finally:
+            self.lock.release()
+
+    def filter_items(self, pred, executor=None, chunk_size=4096):
+        """Return a new Dictionary with the items for which pred(key, value)
+           is true. The items are split into chunks of chunk_size, which are
+           filtered by executor if given, like in map_values."""
+        mapper = map if executor is None else executor.map
+        new_dict = Dictionary()
+        for entries in mapper(partial(_filter_entries, pred), 
+                              self.__entry_chunks(chunk_size)):
+            new_dict._insert_entries(entries)
+        return new_dict
+
+    def reduce_items(self, fn, init, executor=None, combine=None, 
+                     chunk_size=4096):
+        """Reduce the items to a single value by calling 
+           acc = fn(acc, key, value) for every item, starting with init.
+           With an executor, the chunks of chunk_size items are reduced by
+           the executor, each starting with init, and the results are 
+           combined in order with combine(acc, chunk_acc), so init must not
+           change the result, like 0 for a sum."""
+        if executor is None:
+            return _reduce_entries(fn, init, self._get_entries())
+        if combine is None:
+            raise TypeError('combine is needed to reduce with an executor')
+        
+        results = executor.map(partial(_reduce_entries, fn, init), 
+                               self.__entry_chunks(chunk_size))
+        return reduce(combine, results, init)
 
     def update(self, other=None, **kwargs):
         """Update the dictionary with the key/value pairs from other, 
@@ -409,31 +1363,49 @@ class Dictionary(object):
                 self.__insert_from_sequence(other)
         self.__insert_from_dict(kwargs)
     
+    def join(self, other, how='inner', fill=None):
+        """Return a generator of (key, value, other_value) for the keys in 
+           both the dictionary and the dictionary other if how is 'inner', or
+           for all the keys in the dictionary if how is 'left', where 
+           other_value is fill for the keys not in other. An inner join 
+           iterates over the smaller dictionary and probes the larger one 
+           with the stored hashes."""
+        if how not in ('inner', 'left'):
+            raise ValueError("how must be 'inner' or 'left', not '{}'".format(how))
+        
+        if how == 'inner' and len(other) < len(self):
+            return ((key, entry[2], value) 
+                    for key_hash, key, value, entry in self.__probe(other, self)
+                    if entry is not None)
+        return ((key, value, fill if entry is None else entry[2])
+                for key_hash, key, value, entry in self.__probe(self, other)
+                if entry is not None or how == 'left')
+
     def keys(self):
         """Return a copy of the dictionary's keys"""
-        return [key for _, key, _ in self.__get_entries()]
+        return [key for _, key, _ in self._get_key_entries()]
 
     def items(self):
         """Return a copy of the dictionary's list of (key, value) pairs."""
-        return [(key, value) for _, key, value in self.__get_entries()]
+        return [(key, value) for _, key, value in self._get_entries()]
 
     def values(self):
         """Return a copy of the dictionary's list of values"""
-        return [value for _, _, value in self.__get_entries()]
+        return [value for _, _, value in self._get_entries()]
 
     def iterkeys(self):
         """Return an iterator over the dictionary's keys"""
-        keys = (key for _, key, _ in self.__get_entries())
+        keys = (key for _, key, _ in self._get_key_entries())
         return _dictionary_keyiterator(keys, self)
 
     def iteritems(self):
         """Return an iterator over the dictionary's (key, value) pairs"""
-        items = ((key, value) for _, key, value in self.__get_entries())
+        items = ((key, value) for _, key, value in self._get_entries())
         return _dictionary_itemiterator(items, self)
 
     def itervalues(self):
         """Return an iterator over the dictionary's values"""
-        values = (value for _, _, value in self.__get_entries())
+        values = (value for _, _, value in self._get_entries())
         return _dictionary_valueiterator(values, self)
 
     def viewkeys(self):
@@ -448,6 +1420,65 @@ class Dictionary(object):
         """Return a new view of the dictionary's items (key/value pairs)."""
         return _dictionary_items(self)
 
+    def iter_chunks(self, size=1024, kind='items'):
+        """Iterate over lists of size keys, values or (key, value) items, as
+           kind is 'keys', 'values' or 'items', where the last list may be
+           shorter. The lists are built from slices of the entry table, and
+           the dictionary is checked for changes once per list instead of
+           once per item, which makes scanning a big dictionary several 
+           times faster than iterating over a view."""
+        self.__check_kind(kind)
+        if size < 1:
+            raise ValueError('size must be at least 1')
+        layout = self._layout
+        entries = self.__entries
+        chunk = []
+        for start in range(0, len(entries), size):
+            chunk.extend(self.__slot_items(entries, start, start + size, kind))
+            while len(chunk) >= size:
+                self.__check_layout(layout)
+                yield chunk[:size]
+                del chunk[:size]
+        if chunk:
+            self.__check_layout(layout)
+            yield chunk
+
+    def items_batched(self, n):
+        """Same as iter_chunks(n, 'items')"""
+        return self.iter_chunks(n, 'items')
+
+    def scan(self, cursor=None, count=1024, kind='items'):
+        """Return (cursor, chunk), where chunk is a list of the keys, values
+           or (key, value) items, as kind says, in the next count slots of
+           the entry table after cursor, and cursor is passed to the next 
+           call, or None when the scan is done. The scan starts with cursor
+           None and may be paused for as long as needed. The items which 
+           are in the dictionary during the whole scan are returned once, 
+           even if the entry table is resized in between. A small table is 
+           returned in one chunk.
+           
+           The cursor holds on to the entry table the scan started on. If 
+           the table has been rebuilt since, the scan goes on over the old
+           table, and looks up its items in the new one, so deleted items
+           are left out and the values are current."""
+        self.__check_kind(kind)
+        if count < 1:
+            raise ValueError('count must be at least 1')
+        if cursor is None:
+            if self.__small:
+                return None, self.__slot_items(self.__entries, 0, self.__len,
+                                               kind)
+            cursor = (self.__entries, 0)
+        entries, start = cursor
+        stop = start + count
+        
+        if entries is self.__entries:
+            chunk = self.__slot_items(entries, start, stop, kind)
+        else:
+            current = self.__current_entries(entries[start:stop])
+            chunk = self.__slot_items(current, 0, len(current), kind)
+        return (None if stop >= len(entries) else (entries, stop)), chunk
+
     def __insert_from_dict(self, other):
         for key in other:
             self[key] = other[key]
@@ -469,90 +1500,1478 @@ class Dictionary(object):
     # the entry table (__entries) are deleted before inserting them to the new 
     # table. Defining generator object with yield wouldn't work since the 
     # entries would already be deleted when generating the entries.
-    def __get_entries(self):
+    def _get_entries(self):
         return (entry for entry in self.__entries if self.__valid_entry(entry))
+
+    # The entries the keys views iterate over, of which only the hashes and
+    # keys are used, so a class which has to load its values can skip that
+    def _get_key_entries(self):
+        return self._get_entries()
+
+    # Same as key in self, with the hash already calculated
+    def _contains_key(self, key, key_hash):
+        return self._lookup(key, key_hash) is not None
     
-    # A general-purpose method that returns an index where 
-    # either key is found or can be inserted.
-    def __get_index(self, key):
-        mask = self.__size-1
-        key_hash = hash(key)
-        key_hash_size_t = c_size_t(key_hash)
-        index = key_hash_size_t.value & mask
-        freeslot = None
-        
-        entry = self.__entries[index]
-        if entry is None:
-            return index
-        elif self.__strict_compare(entry, key_hash, key):
-            return index
-        elif type(entry) is _Dummy:
-            freeslot = index
-            
-        # A collision occured. Tries the other bits of the hash
-        i = index
-        perturb = key_hash_size_t
+    # Return the entries with the values unwrapped, overridden by the 
+    # subclasses which wrap their values
+    def _unwrap_entries(self, entries):
+        return entries
+
+    # The keys, values or items in the slots start to stop of entries, in
+    # one pass over a slice of the entry table
+    def __slot_items(self, entries, start, stop, kind):
+        entries = self._unwrap_entries([entry for entry in entries[start:stop] 
+                                        if type(entry) is tuple])
+        if kind == 'items':
+            return [entry[1:] for entry in entries]
+        index = 1 if kind == 'keys' else 2
+        return [entry[index] for entry in entries]
+
+    # The entries in the current entry table for the keys of the valid 
+    # entries in entries, which are from a table that has been rebuilt
+    def __current_entries(self, entries):
+        current = []
+        for entry in entries:
+            if type(entry) is tuple:
+                index = self.__get_index(entry[1], entry[0])
+                if self.__valid_entry(self.__entries[index]):
+                    current.append(self.__entries[index])
+        return current
 
-        while True:
-            i = (i << 2) + i + perturb.value + 1
-            index = i & mask
-        
-            entry = self.__entries[index]
-            if entry is None:
-                return index if freeslot is None else freeslot
-            elif self.__strict_compare(entry, key_hash, key):
-                return index
-            elif type(entry) is _Dummy and freeslot is None:
-                    freeslot = index
-            
-            perturb.value >>= 5
+    @staticmethod
+    def __check_kind(kind):
+        if kind not in ('keys', 'values', 'items'):
+            raise ValueError("kind must be 'keys', 'values' or 'items'")
+
+    def __check_layout(self, layout):
+        if self._layout != layout:
+            raise RuntimeError('dictionary changed during iteration')
 
+    # Yields (key_hash, key, value, entry) for the entries in iterated, where
+    # entry is the entry for key in probed, or None if key isn't there
     @staticmethod
-    def __strict_compare(entry, key_hash, key):
-        if type(entry) is not _Dummy:
-            entry_hash, entry_key, _ = entry
-            return entry_hash == key_hash and entry_key == key
-    
-    # Return True if there is an entry and the entry
-    # isn't a dummy value, else return False
+    def __probe(iterated, probed):
+        for key_hash, key, value in iterated._get_entries():
+            yield key_hash, key, value, probed._lookup(key, key_hash)
+
+    # A list of lists of up to size entries, taken with the lock held
+    def __entry_chunks(self, size):
+        self.lock.acquire()
+        try:
+            return list(_chunks(self._get_entries(), size))
+        finally:
+            self.lock.release()
+
+    def __repr_parts(self, max_items):
+        items = ('{}: {}'.format(_repr_value(key), _repr_value(value))
+                 for _, key, value in self._get_entries())
+        return _repr_parts('{', items, '}', max_items)
+
+    # XORs out the fingerprint of the old entry if it's a valid entry, and 
+    # XORs in the fingerprint of the new entry if there is one
+    def __update_fingerprint(self, old_entry, new_entry):
+        try:
+            if self.__valid_entry(old_entry):
+                self.__fingerprint ^= self.__entry_fingerprint(old_entry)
+            if new_entry is not None:
+                self.__fingerprint ^= self.__entry_fingerprint(new_entry)
+        except TypeError:
+            self.__fingerprint = None
+
     @staticmethod
-    def __valid_entry(entry):
-        return entry is not None and type(entry) is not _Dummy   
-    
-    # Resize it if its more than 2/3 full, else just delete dummy values 
-    # from the table and insert the entris into the fresh table
-    def __resize(self):
-        # Checks if dictionary really need to resize
-        # or just have to get rid of Dummy entries
-        if len(self) >= (len(self.__entries) * (2.0/3.0)):
-            if self.__true_len < 50000:
-                self.__size *= 4
-                prev = self.__prev_size/4
-                self.__prev_size = prev if prev > self.__BASE_SIZE else self.__BASE_SIZE
-            else:
-                self.__size *= 2
-                self.__prev_size /= 2
-        
+    def __entry_fingerprint(entry):
+        key_hash, _, value = entry
+        return hash((key_hash, hash(value)))
+
+    # The bytes used by the entry table, the entry tuples, the dummy values
+    # and the auxiliary structures, which includes the object itself
+    def __structure_sizes(self):
+        auxiliary = object.__sizeof__(self) + getsizeof(self.lock)
+        if self.__resize_policy is not _DEFAULT_RESIZE_POLICY:
+            auxiliary += getsizeof(self.__resize_policy)
+        if self.__bloom is not None:
+            auxiliary += getsizeof(self.__bloom)
+        if self.__front is not None:
+            auxiliary += getsizeof(self.__front)
+        return (getsizeof(self.__entries), self.__len * _ENTRY_SIZE,
+                (self.__true_len - self.__len) * _DUMMY_SIZE, auxiliary)
+
+    # Return the entry for key, or None if key is not in the dictionary.
+    # Used by the views to probe with the hashes stored in the entries
+    def _lookup(self, key, key_hash=None):
+        return self.__find(key, hash(key) if key_hash is None else key_hash)
+
+    # Drops the dummy values by moving the entries into an entry table of the
+    # size they would have if they were inserted into an empty dictionary.
+    # Used after bulk deletes, so they don't leave a table full of dummies.
+    def _compact(self):
+        self.lock.acquire()
+        try:
+            self.__size = self.__resize_policy.size_for(self.__len)
+            self.__rebuild()
+        finally:
+            self.lock.release()
+
+    # Resizes the entry table to the size the resize policy gives for n 
+    # items, so that many can be inserted without resizing
+    def _reserve(self, n):
+        self.lock.acquire()
+        try:
+            self.__size = self.__resize_policy.size_for(max(n, self.__len))
+            self.__rebuild()
+        finally:
+            self.lock.release()
+
+    # Inserts the (key_hash, key, value) entries in entries without ever
+    # shrinking the entry table
+    def _insert_entries(self, entries):
+        self.lock.acquire()
+        try:
+            for key_hash, key, value in entries:
+                self.__insert(key, key_hash, value, shrink=False)
+        finally:
+            self.lock.release()
+
+    # Counts a change made by a subclass which changes a value in place
+    def _changed(self):
+        self.__version += 1
+
+    # Moves the entries, or the valid entries in the list entries if given,
+    # into a fresh entry table with self.__size slots
+    def __rebuild(self, entries=None):
+        self._layout += 1
+        if self.__lock_stats is not None:
+            self.__lock_stats.resizing = True
+        self.__small = self.__size <= self.__BASE_SIZE
+        self.__set_thresholds()
         self.__len = 0
         self.__true_len = 0
-        self.__add_entries()
+        self.__reset_front_cache()
+        self.__add_entries(entries)
+
+    # The slots in the front cache point into the old entry table after the
+    # entries have been moved, so they are all reset
+    def __reset_front_cache(self):
+        if self.__front is not None:
+            self.__front = [0] * len(self.__front)
+
+    # Sets the number of used slots at which the entry table is resized, and
+    # the number of items below which it's shrunk, which is 0 if the items 
+    # wouldn't fit in a smaller table
+    def __set_thresholds(self):
+        policy = self.__resize_policy
+        size = self.__size
+        shrink_at = size * policy.shrink_load
+        if policy.size_for(int(shrink_at)) >= size:
+            shrink_at = 0
+        self.__grow_at = size * policy.max_load
+        self.__shrink_at = shrink_at
+
+    # Return the entry for key, or None if key is not in the dictionary.
+    # Checks the front cache and the bloom filter, if there are any, before
+    # probing. A slot in the front cache is only a hint, the entry in it is
+    # always compared with key, so deleted, overwritten or moved entries 
+    # don't need to be removed from the cache.
+    def __find(self, key, key_hash):
+        entry = None
+        front = self.__front
+        if front is not None:
+            place = key_hash & self.__front_mask
+            cached = self.__entries[front[place]]
+            if (type(cached) is tuple and cached[0] == key_hash and 
+                (cached[1] is key or cached[1] == key)):
+                entry = cached
+                self.__front_hits += 1
+            else:
+                self.__front_misses += 1
         
-    # The opposite as resize, this method shrinks the entry table.
-    # This happens when there are dummy values stored in the entry table
-    # and the number of items could fit in a smaller entry table
-    def __shrink(self):
-        self.__size /= 4 if len(self) < 50000 else 2
-        #self.__prev_size
-        self.__len = 0
-        self.__true_len = 0
-        self.__add_entries()
+        if entry is None and (self.__bloom is None or 
+                              self.__bloom_contains(key_hash)):
+            index = self.__get_index(key, key_hash)
+            if self.__valid_entry(self.__entries[index]):
+                entry = self.__entries[index]
+                if front is not None:
+                    front[place] = index
+        
+        if self.__tuning is not None:
+            if entry is None:
+                self.__tuning.misses += 1
+            else:
+                self.__tuning.hits += 1
+        return entry
+
+    # The three bits of the bloom filter which are set for key_hash,
+    # picked by double hashing from the spread hash
+    def __bloom_bits(self, key_hash):
+        spread = (key_hash * _BLOOM_MULTIPLIER) & _SIZE_T_MASK
+        step = (spread >> 32) | 1
+        mask = (len(self.__bloom) << 3) - 1
+        return spread & mask, (spread + step) & mask, (spread + 2*step) & mask
+
+    def __bloom_add(self, key_hash):
+        bloom = self.__bloom
+        for bit in self.__bloom_bits(key_hash):
+            bloom[bit >> 3] |= 1 << (bit & 7)
+
+    def __bloom_contains(self, key_hash):
+        bloom = self.__bloom
+        for bit in self.__bloom_bits(key_hash):
+            if not bloom[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+    # Shared by setdefault and get_or_insert, inserts default, 
+    # or factory() if factory is given, if key is not in the dictionary
+    def __get_or_insert(self, key, default, factory):
+        key_hash = hash(key)
+        self.lock.acquire()
+        try:
+            index = self.__get_index(key, key_hash)
+            entry = self.__entries[index]
+            if self.__valid_entry(entry):
+                return entry[2]
+            value = default if factory is None else factory()
+            self.__store(index, key, key_hash, value)
+            return value
+        finally:
+            self.lock.release()
+
+    # Inserts key and value with a hash that's already calculated.
+    # The default argument 'shrink' is used internally to prevent recursive 
+    # shrinking and reseeding when inserting entries into the entry table after 
+    # resizing/shrinking the entry table
+    def __insert(self, key, key_hash, value, shrink=True):
+        self.lock.acquire()
+        self.__store(self.__get_index(key, key_hash), key, key_hash, value, shrink)
+        self.lock.release()
+
+    # Stores the entry at index, which must be the index returned by
+    # __get_index for key. The caller must hold the lock.
+    def __store(self, index, key, key_hash, value, shrink=True):
+        entry = self.__entries[index]
+
+        if entry is None:
+            self.__len += 1    
+            self.__true_len += 1
+            self._layout += 1
+        elif type(entry) is _Dummy:
+            self.__len += 1
+            self._layout += 1
+        self.__version += 1
+        
+        if self.__fingerprint is not None:
+            self.__update_fingerprint(entry, (key_hash, key, value))
+        if self.__bloom is not None and not self.__valid_entry(entry):
+            self.__bloom_add(key_hash)
+        self.__entries[index] = (key_hash, key, value)
+        
+        if self.__small:
+            if self.__len >= self.__BASE_SIZE:
+                self.__small = False
+                self.__resize()
+        elif self.__true_len >= self.__grow_at:
+            self.__resize()
+        elif shrink and self.__flooded:
+            self.__reseed()
+        elif shrink and self.__len < self.__shrink_at:
+            self.__shrink()
+
+    # A general-purpose method that returns an index where either key is found
+    # or can be inserted. key_hash is the hash of key, if already calculated
+    def __get_index(self, key, key_hash=None):
+        if key_hash is None:
+            key_hash = hash(key)
+        if self.__small:
+            return self.__get_small_index(key, key_hash)
+        mask = self.__size-1
+        if self.__seed is None:
+            perturb = key_hash & _SIZE_T_MASK
+        else:
+            perturb = self.__mix(key_hash)
+        index = perturb & mask
+        freeslot = None
+        
+        entry = self.__entries[index]
+        if entry is None:
+            return index
+        elif self.__strict_compare(entry, key_hash, key):
+            return index
+        elif type(entry) is _Dummy:
+            freeslot = index
+            
+        # A collision occured. Tries the other bits of the hash
+        i = index
+        probes = 1
+        max_probes = self.__max_probes
+
+        while True:
+            i = (i << 2) + i + perturb + 1
+            index = i & mask
+        
+            entry = self.__entries[index]
+            if entry is None:
+                return index if freeslot is None else freeslot
+            elif self.__strict_compare(entry, key_hash, key):
+                return index
+            elif type(entry) is _Dummy and freeslot is None:
+                    freeslot = index
+            
+            perturb >>= 5
+            probes += 1
+            if probes == max_probes and not self.__equal_hashes(key_hash):
+                self.__flooded = True
+
+    # The probe lengths of up to about count entries, spread over the table
+    def __sample_probe_lengths(self, count=64):
+        entries = self.__entries
+        lengths = []
+        for index in range(0, len(entries), max(len(entries) // count, 1)):
+            entry = entries[index]
+            if self.__valid_entry(entry):
+                lengths.append(self.__probe_length(entry[0], index))
+        return lengths
+
+    # The number of slots __get_index probes to find the entry with 
+    # key_hash at index
+    def __probe_length(self, key_hash, index):
+        mask = self.__size-1
+        if self.__seed is None:
+            perturb = key_hash & _SIZE_T_MASK
+        else:
+            perturb = self.__mix(key_hash)
+        i = perturb & mask
+        length = 1
+        
+        while i & mask != index:
+            i = (i << 2) + i + perturb + 1
+            perturb >>= 5
+            length += 1
+        return length
+
+    # True if at least half of the first max_probes slots probed for key_hash
+    # hold keys with the same hash, which a new seed wouldn't spread out
+    def __equal_hashes(self, key_hash):
+        mask = self.__size-1
+        perturb = self.__mix(key_hash)
+        i = perturb & mask
+        equal = 0
+        
+        for _ in range(self.__max_probes):
+            entry = self.__entries[i & mask]
+            if self.__valid_entry(entry) and entry[0] == key_hash:
+                equal += 1
+            i = (i << 2) + i + perturb + 1
+            perturb >>= 5
+        return 2 * equal >= self.__max_probes
+
+    # Mixes the seed into key_hash, so every bit of the result depends on 
+    # all the bits of the hash and the seed
+    def __mix(self, key_hash):
+        first, second = _MIX_MULTIPLIERS
+        mixed = ((key_hash ^ self.__seed) * first) & _SIZE_T_MASK
+        mixed = ((mixed ^ (mixed >> _HALF_SIZE_T_BITS)) * second) & _SIZE_T_MASK
+        return mixed ^ (mixed >> _HALF_SIZE_T_BITS)
+
+    # Picks a new seed and rebuilds the table after a lookup has probed more
+    # than max_probes slots, unless that has already been done at this size
+    def __reseed(self):
+        self.__flooded = False
+        if self.__reseeded_size != self.__size:
+            self.__reseeded_size = self.__size
+            self.__seed = SystemRandom().getrandbits(8 * sizeof(c_size_t))
+            self.__reseeds += 1
+            self.__rebuild()
+
+    # Small tables keep their entries packed at the start of the entry table,
+    # so a linear scan on the stored hashes either finds the key or stops
+    # at the first free slot. Skips the hashing machinery for tiny tables.
+    def __get_small_index(self, key, key_hash):
+        entries = self.__entries
+
+        for index in range(self.__len):
+            entry_hash, entry_key, _ = entries[index]
+            if entry_hash == key_hash and entry_key == key:
+                return index
+        return self.__len
+
+    @staticmethod
+    def __strict_compare(entry, key_hash, key):
+        if type(entry) is not _Dummy:
+            entry_hash, entry_key, _ = entry
+            return entry_hash == key_hash and entry_key == key
+    
+    # Return True if there is an entry and the entry
+    # isn't a dummy value, else return False
+    @staticmethod
+    def __valid_entry(entry):
+        return entry is not None and type(entry) is not _Dummy   
     
+    # Grows the entry table as the resize policy says if it's full, else just
+    # deletes the dummy values by moving the entries into a fresh table
+    def __resize(self):
+        policy = self.__counting_policy()
+        if self.__tuning is not None and self.__size > self.__BASE_SIZE:
+            self.__tuning.adjust(self.__len, self.__sample_probe_lengths())
+        if self.__len >= self.__grow_at:
+            self.__size = policy.grown_size(self.__size, self.__len)
+            policy.grows += 1
+        else:
+            policy.cleanups += 1
+        self.__rebuild()
+    
+    # Return the resize policy, after replacing the shared default with a
+    # policy of its own, whose counters only count this dictionary's resizes
+    def __counting_policy(self):
+        if self.__resize_policy is _DEFAULT_RESIZE_POLICY:
+            self.__resize_policy = ResizePolicy()
+        return self.__resize_policy
+    
+    # The opposite as resize, this method shrinks the entry table to the size
+    # the resize policy gives for the items. This happens when there are 
+    # fewer items than the policy's shrink threshold
+    def __shrink(self):
+        self.__size = self.__resize_policy.size_for(self.__len)
+        self.__counting_policy().shrinks += 1
+        self.__rebuild()
+
     # Helper function used by resize and shink to reset the entry 
-    # table and insert all items into the new entry table
-    def __add_entries(self):
-        entries = self.__get_entries()
+    # table and insert all items, or the entries in entries if given, into
+    # the new entry table, with the hashes stored in the entries. Calls 
+    # Dictionary's own _get_entries, since a subclass may override it to 
+    # unwrap the values.
+    def __add_entries(self, entries=None):
+        if entries is None:
+            entries = Dictionary._get_entries(self)
         self.__entries = [None] * self.__size
+        # The bloom filter is rebuilt for the new size as the entries are 
+        # inserted, which also drops the keys which have been deleted
+        on = self.__bloom_on and not self.__small
+        self.__bloom = bytearray(self.__size) if on else None
+        # The fingerprint doesn't change when the entries are moved
+        fingerprint = self.__fingerprint
+        self.__fingerprint = None
+        
+        for key_hash, key, value in entries:
+            self.__insert(key, key_hash, value, shrink=False)
+        self.__fingerprint = fingerprint
 
-        for _, key, value in entries:
-            self.__setitem__(key, value, shrink=False)
-    
+
+# Yields lists of up to size items from iterable
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+# The key types whose hashes are the same in every process, once they
+# agree on the seed for hashing strings
+_PORTABLE_HASH_TYPES = frozenset((str, unicode, int, long))
+
+
+def _portable_hash(key):
+    if type(key) is tuple:
+        return all(_portable_hash(item) for item in key)
+    return type(key) in _PORTABLE_HASH_TYPES
+
+
+# Run by the worker processes of Dictionary.build_parallel. Returns the 
+# key/value pairs in pairs as entries, with the hashes of the keys, or None
+# for keys whose hashes can't be used in another process.
+def _hash_pairs(pairs):
+    return [(hash(key) if _portable_hash(key) else None, key, value) 
+            for key, value in pairs]
+
+
+# Run by the executors of map_values, filter_items and reduce_items
+def _map_values(fn, values):
+    return [fn(value) for value in values]
+
+
+def _filter_entries(pred, entries):
+    return [entry for entry in entries if pred(entry[1], entry[2])]
+
+
+def _reduce_entries(fn, acc, entries):
+    for _, key, value in entries:
+        acc = fn(acc, key, value)
+    return acc
+
+
+# The size of obj and of the objects in it, if it's a container, where the
+# objects found more than once are counted once
+def _deep_sizeof(obj):
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += getsizeof(obj)
+        if isinstance(obj, (tuple, list, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, (dict, Dictionary)):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+    return size
+
+
+# The read-modify-write methods for the subclasses which wrap their values,
+# built from their own lookups and inserts, with the lock held throughout
+class _locked_updates(object):
+    __slots__ = ()
+
+    def setdefault(self, key, default=None):
+        """Same as Dictionary.setdefault"""
+        return self.get_or_insert(key, lambda: default)
+
+    def get_by_hash(self, key_hash, key, default=None):
+        """Same as Dictionary.get_by_hash"""
+        return self.get(key, default)
+
+    def set_by_hash(self, key_hash, key, value):
+        """Same as Dictionary.set_by_hash"""
+        self[key] = value
+
+    def get_or_insert(self, key, factory):
+        """Same as Dictionary.get_or_insert"""
+        self.lock.acquire()
+        try:
+            try:
+                return self[key]
+            except KeyError:
+                value = factory()
+            self[key] = value
+            return value
+        finally:
+            self.lock.release()
+
+    def upsert(self, key, fn, default=None):
+        """Same as Dictionary.upsert"""
+        self.lock.acquire()
+        try:
+            try:
+                value = self[key]
+            except KeyError:
+                value = default
+            value = fn(value)
+            self[key] = value
+            return value
+        finally:
+            self.lock.release()
+
+    def increment(self, key, delta=1):
+        """Same as Dictionary.increment"""
+        return self.upsert(key, lambda value: value + delta, 0)
+
+    def map_values(self, fn, executor=None, chunk_size=4096):
+        """Same as Dictionary.map_values, but the new values are set one 
+           key at a time, once all of them have been computed"""
+        mapper = map if executor is None else executor.map
+        self.lock.acquire()
+        try:
+            items = list(self.items())
+            chunks = _chunks((value for _, value in items), chunk_size)
+            values = list(chain.from_iterable(
+                mapper(partial(_map_values, fn), chunks)))
+            for (key, _), value in izip(items, values):
+                self[key] = value
+        finally:
+            self.lock.release()
+
+    def pop_if(self, key, pred, default=None):
+        """Same as Dictionary.pop_if"""
+        self.lock.acquire()
+        try:
+            try:
+                value = self[key]
+            except KeyError:
+                return default
+            if pred(value):
+                del self[key]
+                return value
+            return default
+        finally:
+            self.lock.release()
+
+    def delete_where(self, pred):
+        """Same as Dictionary.delete_where"""
+        self.lock.acquire()
+        try:
+            keys = [key for key, value in self.items() if pred(key, value)]
+            return self.delete_many(keys)
+        finally:
+            self.lock.release()
+
+    def delete_many(self, keys):
+        """Same as Dictionary.delete_many"""
+        self.lock.acquire()
+        try:
+            removed = 0
+            for key in keys:
+                try:
+                    del self[key]
+                except KeyError:
+                    continue
+                removed += 1
+            if removed:
+                self._compact()
+            return removed
+        finally:
+            self.lock.release()
+
+
+# Indexes into the links used by BoundedDictionary. An item link is
+# [prev, next, key, value, bucket], and with the 'lfu' policy the items are
+# kept in frequency buckets [prev, next, frequency, items], where items is
+# the root of a list of item links.
+_PREV, _NEXT, _KEY, _VALUE, _BUCKET = 0, 1, 2, 3, 4
+_FREQ, _ITEMS = 2, 3
+
+
+# Return the root of an empty circular doubly linked list
+def _link_root():
+    root = []
+    root[:] = [root, root, None, None, None]
+    return root
+
+
+# Insert link right before node, which appends it to the
+# end of the list if node is the root of the list
+def _link_insert(node, link):
+    prev = node[_PREV]
+    link[_PREV] = prev
+    link[_NEXT] = node
+    prev[_NEXT] = node[_PREV] = link
+
+
+def _link_remove(link):
+    prev, next_link = link[_PREV], link[_NEXT]
+    prev[_NEXT] = next_link
+    next_link[_PREV] = prev
+
+
+class BoundedDictionary(_locked_updates, Dictionary):
+    """A dictionary which holds at most maxsize items, meant to be used as a
+       cache. When a key is inserted into a full dictionary, the least recently
+       used ('lru') or least frequently used ('lfu') item is evicted first.
+       
+       The values are stored in links together with the recency or frequency 
+       information, so both lookups and evictions are O(1). If on_evict is 
+       given, it's called with the key and value of every item before it's
+       evicted. If it raises, the item is kept and the insert fails."""
+
+    __slots__ = ('__maxsize', '__policy', '__root', '__hits', '__misses',
+                 '__evictions', '__on_evict')
+
+    _fingerprints = False
+
+    def __init__(self, maxsize, policy='lru', sequence=None, on_evict=None):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError("policy must be 'lru' or 'lfu', not '{}'".format(policy))
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        
+        self.__maxsize = maxsize
+        self.__policy = policy
+        self.__on_evict = on_evict
+        Dictionary.__init__(self, sequence)
+
+    @property
+    def maxsize(self):
+        return self.__maxsize
+
+    @property
+    def policy(self):
+        return self.__policy
+
+    def stats(self):
+        """Return a dictionary with the number of hits, misses and evictions 
+           since the dictionary was created or last cleared."""
+        return Dictionary(hits=self.__hits, misses=self.__misses,
+                          evictions=self.__evictions, size=len(self),
+                          maxsize=self.__maxsize)
+
+    def __getitem__(self, key):
+        """Return the item of dictionary with key 'key' and mark it as used.
+           Raises a KeyError if key is not in the map."""
+        self.lock.acquire()
+        try:
+            link = Dictionary.__getitem__(self, key)
+        except KeyError:
+            self.__misses += 1
+            raise
+        else:
+            self.__hits += 1
+            self.__touch(link)
+            return link[_VALUE]
+        finally:
+            self.lock.release()
+
+    def __setitem__(self, key, value):
+        """Set dictionary[key] to value, evicting an item if the dictionary
+           is full and key is not in the dictionary."""
+        self.lock.acquire()
+        try:
+            link = Dictionary.__getitem__(self, key)
+        except KeyError:
+            if len(self) >= self.__maxsize:
+                self.__evict()
+            link = [None, None, key, value, None]
+            self.__insert(link)
+            Dictionary.__setitem__(self, key, link)
+        else:
+            link[_VALUE] = value
+            self._changed()
+            self.__touch(link)
+        finally:
+            self.lock.release()
+
+    # The default argument 'index' is only here to match
+    # the signature of Dictionary.__delitem__
+    def __delitem__(self, key, index=None):
+        """Remove dictionary[key] from dictionary.
+           Raises a KeyError if key is not in the map"""
+        self.lock.acquire()
+        try:
+            link = Dictionary.__getitem__(self, key)
+            Dictionary.__delitem__(self, key, index)
+            self.__remove(link)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        """Remove all items from the dictionary and reset the statistics"""
+        Dictionary.clear(self)
+        self.__root = _link_root()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def copy(self):
+        """Return a shallow copy of the dictionary"""
+        return self.__class__(self.__maxsize, self.__policy, self.items())
+
+    def pop(self, key, default=_MISSING):
+        """If the key is in the dictionary, remove it and return its value, 
+           else return default. If default is not given, and key is not in the
+           dictionary, a KeyError is raised."""
+        self.lock.acquire()
+        try:
+            return Dictionary.pop(self, key)[_VALUE]
+        except KeyError:
+            if default is not _MISSING:
+                return default
+            raise
+        finally:
+            self.lock.release()
+
+    # Unwraps the values from the links, so the views
+    # and repr show the values and not the links
+    def _get_entries(self):
+        return self._unwrap_entries(Dictionary._get_entries(self))
+
+    def _unwrap_entries(self, entries):
+        return ((key_hash, key, link[_VALUE]) 
+                for key_hash, key, link in entries)
+
+    # Unwraps the value from the link, without marking the item as used
+    def _lookup(self, key, key_hash=None):
+        entry = Dictionary._lookup(self, key, key_hash)
+        if entry is None:
+            return None
+        key_hash, key, link = entry
+        return key_hash, key, link[_VALUE]
+
+    # Evicts the item at the front of the least recently used list, or the
+    # oldest item in the lowest frequency bucket
+    def __evict(self):
+        front = self.__root[_NEXT]
+        link = front if self.__policy == 'lru' else front[_ITEMS][_NEXT]
+        if self.__on_evict is not None:
+            self.__on_evict(link[_KEY], link[_VALUE])
+        Dictionary.__delitem__(self, link[_KEY])
+        self.__remove(link)
+        self.__evictions += 1
+
+    def __insert(self, link):
+        if self.__policy == 'lru':
+            _link_insert(self.__root, link)
+        else:
+            self.__add_to_bucket(link, self.__root, 1)
+
+    def __remove(self, link):
+        _link_remove(link)
+        if link[_BUCKET] is not None:
+            self.__remove_empty(link[_BUCKET])
+
+    @staticmethod
+    def __remove_empty(bucket):
+        if bucket[_ITEMS][_NEXT] is bucket[_ITEMS]:
+            _link_remove(bucket)
+
+    # Marks the item as used, by moving it to the back of the least recently
+    # used list, or to the bucket with the next frequency
+    def __touch(self, link):
+        if self.__policy == 'lru':
+            _link_remove(link)
+            _link_insert(self.__root, link)
+        else:
+            bucket = link[_BUCKET]
+            _link_remove(link)
+            self.__add_to_bucket(link, bucket, bucket[_FREQ] + 1)
+            self.__remove_empty(bucket)
+
+    # Adds the item to the bucket with frequency freq right after the node
+    # prev, creates the bucket if it's not there. The buckets are sorted
+    # by frequency, so the lowest frequency bucket is always in front.
+    def __add_to_bucket(self, link, prev, freq):
+        bucket = prev[_NEXT]
+        if bucket is self.__root or bucket[_FREQ] != freq:
+            bucket = [None, None, freq, _link_root(), None]
+            _link_insert(prev[_NEXT], bucket)
+        link[_BUCKET] = bucket
+        _link_insert(bucket[_ITEMS], link)
+
+
+class TTLDictionary(_locked_updates, Dictionary):
+    """A dictionary where every key expires ttl seconds after it was set.
+       
+       The values are stored in records [key, value, expiry, due], where
+       due is the expiry the record was scheduled for. An expired key counts
+       as a miss when it's looked up, and is removed at the same time.
+       Expired keys that aren't looked up again are removed in small batches
+       by a hierarchical timer wheel, either on insertion or by calling
+       expire(), and by len() before it counts the keys. Since the wheel
+       advances a tick of 'resolution' seconds at a time, len() may still
+       count keys which expired less than a tick ago. Comparisons only look
+       at the keys which haven't expired.
+       
+       Overwriting a key updates its record in place, and a record whose 
+       expiry was extended is just scheduled again when it comes due, so a
+       key which is set over and over has a single record in the wheel."""
+
+    # Each level of the timer wheel has 64 slots, a slot at level n
+    # covers 64**n ticks, where a tick is 'resolution' seconds long
+    __WHEEL_BITS = 6
+    __WHEEL_SIZE = 1 << __WHEEL_BITS
+    __WHEEL_MASK = __WHEEL_SIZE - 1
+    __WHEEL_LEVELS = 4
+    # Max number of expired keys removed by each insertion
+    __SWEEP_BATCH = 8
+
+    __slots__ = ('__ttl', '__resolution', '__clock', '__wheel', '__tick',
+                 '__scheduled')
+
+    _fingerprints = False
+
+    def __init__(self, ttl, sequence=None, resolution=1.0, clock=_clock):
+        if ttl <= 0 or resolution <= 0:
+            raise ValueError('ttl and resolution must be positive')
+        
+        self.__ttl = ttl
+        self.__resolution = float(resolution)
+        self.__clock = clock
+        Dictionary.__init__(self, sequence)
+
+    @property
+    def ttl(self):
+        return self.__ttl
+
+    def __getitem__(self, key):
+        """Return the item of dictionary with key 'key'.
+           Raises a KeyError if key is not in the map or has expired."""
+        return self.__get_record(key)[1]
+
+    def __setitem__(self, key, value):
+        """Set dictionary[key] to value, which expires after ttl seconds."""
+        self.set(key, value)
+
+    def __len__(self):
+        """Return the number of items in the dictionary, after removing the
+           expired keys which the timer wheel has reached."""
+        self.lock.acquire()
+        try:
+            self.__expire(self.__clock())
+            return Dictionary.__len__(self)
+        finally:
+            self.lock.release()
+
+    def __contains__(self, key):
+        """Return true if dictionary has key and it hasn't expired."""
+        try:
+            self.__get_record(key)
+            return True
+        except KeyError:
+            return False
+
+    # The default argument 'index' is only here to match
+    # the signature of Dictionary.__delitem__
+    def __delitem__(self, key, index=None):
+        """Remove dictionary[key] from dictionary.
+           Raises a KeyError if key is not in the map or has expired"""
+        self.lock.acquire()
+        try:
+            self.__get_record(key)
+            Dictionary.__delitem__(self, key)
+        finally:
+            self.lock.release()
+
+    def set(self, key, value, ttl=None):
+        """Set dictionary[key] to value, which expires after ttl seconds.
+           If ttl is not given, it defaults to the ttl of the dictionary."""
+        self.lock.acquire()
+        try:
+            now = self.__clock()
+            expiry = now + (self.__ttl if ttl is None else ttl)
+            record = self.__stored(key)
+            if record is not None and expiry >= record[3]:
+                record[1] = value
+                record[2] = expiry
+                self._changed()
+            else:
+                record = [key, value, expiry, expiry]
+                Dictionary.__setitem__(self, key, record)
+                self.__schedule(record)
+            self.__expire(now, self.__SWEEP_BATCH)
+        finally:
+            self.lock.release()
+
+    def expire(self, limit=None):
+        """Remove the keys which have expired, but no more than limit keys
+           if limit is given. Return the number of keys removed."""
+        self.lock.acquire()
+        try:
+            return self.__expire(self.__clock(), limit)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        """Remove all items from the dictionary"""
+        Dictionary.clear(self)
+        self.__wheel = [[[] for _ in range(self.__WHEEL_SIZE)] 
+                        for _ in range(self.__WHEEL_LEVELS)]
+        self.__tick = self.__to_tick(self.__clock())
+        self.__scheduled = [0] * self.__WHEEL_LEVELS
+
+    def copy(self):
+        """Return a shallow copy of the dictionary, where the keys 
+           expire at the same time as in this dictionary"""
+        new_dict = self.__class__(self.__ttl, resolution=self.__resolution,
+                                  clock=self.__clock)
+        now = self.__clock()
+        for _, _, (key, value, expiry, _) in Dictionary._get_entries(self):
+            if expiry > now:
+                new_dict.set(key, value, expiry - now)
+        return new_dict
+
+    def pop(self, key, default=_MISSING):
+        """If the key is in the dictionary, remove it and return its value, 
+           else return default. If default is not given, and key is not in the
+           dictionary, a KeyError is raised."""
+        self.lock.acquire()
+        try:
+            value = self.__get_record(key)[1]
+            Dictionary.__delitem__(self, key)
+            return value
+        except KeyError:
+            if default is not _MISSING:
+                return default
+            raise
+        finally:
+            self.lock.release()
+
+    # Compares the keys which haven't expired, of both dictionaries if other
+    # is a TTLDictionary too, since len() may count some expired keys
+    def __eq__(self, other):
+        if not isinstance(other, (Dictionary, SpillDictionary, dict)):
+            return False
+        
+        entries = list(self._get_entries())
+        if isinstance(other, TTLDictionary):
+            size = sum(1 for _ in other._get_entries())
+        else:
+            size = len(other)
+        
+        if len(entries) != size:
+            return False
+        elif isinstance(other, dict):
+            return all(key in other and other[key] == value 
+                       for _, key, value in entries)
+        for key_hash, key, value in entries:
+            entry = other._lookup(key, key_hash)
+            if entry is None or not entry[2] == value:
+                return False
+        return True
+
+    __hash__ = Dictionary.__hash__
+
+    # Unwraps the values from the records and leaves out the expired keys
+    def _get_entries(self):
+        return self._unwrap_entries(Dictionary._get_entries(self))
+
+    def _unwrap_entries(self, entries):
+        now = self.__clock()
+        return ((key_hash, key, value) 
+                for key_hash, key, (_, value, expiry, _) in entries
+                if expiry > now)
+
+    # Unwraps the value from the record, and leaves out the key if it has
+    # expired. It's not removed here, since this is used while iterating.
+    def _lookup(self, key, key_hash=None):
+        entry = Dictionary._lookup(self, key, key_hash)
+        if entry is None or entry[2][2] <= self.__clock():
+            return None
+        return entry[0], entry[1], entry[2][1]
+
+    # Return the record for key, removes it and raises a KeyError if the
+    # key has expired, so that an expired key always counts as a miss
+    def __get_record(self, key):
+        self.lock.acquire()
+        try:
+            record = Dictionary.__getitem__(self, key)
+            if record[2] <= self.__clock():
+                Dictionary.__delitem__(self, key)
+                raise KeyError(key)
+            return record
+        finally:
+            self.lock.release()
+
+    # Return the record stored for key, or None, without checking if it expired
+    def __stored(self, key):
+        try:
+            return Dictionary.__getitem__(self, key)
+        except KeyError:
+            return None
+
+    def __to_tick(self, time):
+        return int(time / self.__resolution)
+
+    # Inserts the record in the lowest level of the wheel where its expiry
+    # tick is within reach from the current tick. Records too far into the
+    # future are put in the last slot of the top level and rescheduled later.
+    def __schedule(self, record):
+        record[3] = record[2]
+        tick = max(self.__to_tick(record[2]), self.__tick)
+        delta = tick - self.__tick
+        
+        for level in range(self.__WHEEL_LEVELS):
+            if delta < 1 << (self.__WHEEL_BITS * (level + 1)):
+                break
+        else:
+            tick = self.__tick + (1 << (self.__WHEEL_BITS * level + self.__WHEEL_BITS)) - 1
+        
+        slot = (tick >> (self.__WHEEL_BITS * level)) & self.__WHEEL_MASK
+        self.__wheel[level][slot].append(record)
+        self.__scheduled[level] += 1
+
+    # Jumps over the ticks where nothing happens, which are the ticks before
+    # the next cascade of the lowest level of the wheel that has records
+    def __skip_empty(self, now_tick):
+        for level in range(self.__WHEEL_LEVELS):
+            if self.__scheduled[level]:
+                break
+        else:
+            self.__tick = now_tick
+            return
+        
+        if level:
+            step = 1 << (self.__WHEEL_BITS * level)
+            tick = (self.__tick + step - 1) & ~(step - 1)
+            self.__tick = min(tick, now_tick)
+
+    # Moves the records in the current slot of each level down the wheel,
+    # when the ticks of the level below have done a full round
+    def __cascade(self):
+        for level in range(1, self.__WHEEL_LEVELS):
+            if (self.__tick >> (self.__WHEEL_BITS * (level - 1))) & self.__WHEEL_MASK:
+                break
+            slot = (self.__tick >> (self.__WHEEL_BITS * level)) & self.__WHEEL_MASK
+            records = self.__wheel[level][slot]
+            self.__wheel[level][slot] = []
+            self.__scheduled[level] -= len(records)
+            for record in records:
+                self.__schedule(record)
+
+    # Advances the wheel up to the current time. Records of keys which have
+    # been deleted or replaced are just dropped, and records whose expiry 
+    # was extended are scheduled again.
+    def __expire(self, now, limit=None):
+        now_tick = self.__to_tick(now)
+        removed = 0
+        
+        while self.__tick < now_tick:
+            self.__skip_empty(now_tick)
+            if self.__tick == now_tick:
+                break
+            self.__cascade()
+            records = self.__wheel[0][self.__tick & self.__WHEEL_MASK]
+            
+            while records:
+                if limit is not None and removed >= limit:
+                    return removed
+                record = records.pop()
+                self.__scheduled[0] -= 1
+                key, _, expiry, _ = record
+                
+                if self.__stored(key) is not record:
+                    continue
+                elif expiry <= now:
+                    Dictionary.__delitem__(self, key)
+                    removed += 1
+                else:
+                    self.__schedule(record)
+            
+            self.__tick += 1
+        return removed
+
+
+class SpillDictionary(object):
+    """A dictionary which keeps at most memory_items items in memory. When
+       there are more, the least recently used items are spilled to a 
+       segment file, where the values are appended one after the other. The
+       spilled keys are kept in an index, a Dictionary with the offset and
+       size of their value in the file. A spilled key which is looked up is
+       read back and moved into memory again, spilling another item.
+       
+       The file is path, or a temporary file if path is None. Values which
+       are read back, overwritten or deleted are left in the file until it's
+       rewritten by compact_segment(), which happens by itself when more 
+       than half of the file, and at least a megabyte, is unused. Values
+       which can't be pickled are found when they are spilled: the insert
+       which would spill one raises the pickling error, and the item stays
+       in memory, marked as used so the next insert spills another one.
+       
+       It has the mapping API of Dictionary, except for its extensions like
+       the hashed lookups, the bulk operations and the tuning options."""
+
+    __COMPACT_BYTES = 1 << 20
+
+    __slots__ = ('lock', '__memory', '__index', '__path', '__segment', 
+                 '__live', '__dead', '__promotions')
+
+    def __init__(self, memory_items, path=None, sequence=None):
+        self.lock = RLock()
+        self.__memory = BoundedDictionary(memory_items, on_evict=self.__spill)
+        self.__index = Dictionary()
+        self.__path = path
+        self.__segment = self.__open_segment(path)
+        self.__live = 0
+        self.__dead = 0
+        self.__promotions = 0
+        if sequence:
+            self.update(sequence)
+
+    def stats(self):
+        """Return a dictionary with the number of items in memory and on 
+           disk, the number of spills and promotions, and the number of used 
+           and unused bytes in the segment file"""
+        return Dictionary(memory=len(self.__memory), spilled=len(self.__index),
+                          spills=self.__memory.stats()['evictions'],
+                          promotions=self.__promotions,
+                          live_bytes=self.__live, dead_bytes=self.__dead)
+
+    @property
+    def version(self):
+        """Same as Dictionary.version"""
+        return self.__memory.version + self.__index.version
+
+    @property
+    def _layout(self):
+        return self.__memory._layout + self.__index._layout
+
+    def __len__(self):
+        return len(self.__memory) + len(self.__index)
+
+    def __contains__(self, key):
+        return key in self.__memory or key in self.__index
+
+    def __getitem__(self, key):
+        """Return the value for key, reading it back into memory if it has
+           been spilled. Raises a KeyError if key is not in the map."""
+        self.lock.acquire()
+        try:
+            try:
+                return self.__memory[key]
+            except KeyError:
+                place = self.__index.get(key)
+                if place is None:
+                    raise KeyError(key)
+            value = self.__read(place)
+            self.__memory[key] = value
+            self.__drop(key)
+            self.__promotions += 1
+            return value
+        finally:
+            self.lock.release()
+
+    def __setitem__(self, key, value):
+        """Set dictionary[key] to value"""
+        self.lock.acquire()
+        try:
+            self.__memory[key] = value
+            if key in self.__index:
+                self.__drop(key)
+        finally:
+            self.lock.release()
+
+    def __delitem__(self, key):
+        """Remove dictionary[key] from dictionary.
+           Raises a KeyError if key is not in the map"""
+        self.lock.acquire()
+        try:
+            if key in self.__index:
+                self.__drop(key)
+            else:
+                del self.__memory[key]
+        finally:
+            self.lock.release()
+
+    def __eq__(self, other):
+        if isinstance(other, TTLDictionary):
+            return other == self
+        elif isinstance(other, dict):
+            return len(self) == len(other) and all(
+                key in other and other[key] == value 
+                for _, key, value in self._get_entries())
+        elif (not isinstance(other, (Dictionary, SpillDictionary)) or 
+                len(self) != len(other)):
+            return False
+        for key_hash, key, value in self._get_entries():
+            entry = other._lookup(key, key_hash)
+            if entry is None or not entry[2] == value:
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        cls = self.__class__.__name__
+        raise TypeError("unhashable type: '{}'".format(cls))
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __repr__(self):
+        items = ('{}: {}'.format(_repr_value(key), _repr_value(value))
+                 for _, key, value in self._get_entries())
+        return ''.join(_repr_parts('SpillDictionary({', items, '})'))
+
+    def get(self, key, default=None):
+        """Same as Dictionary.get"""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, default=_MISSING):
+        """Same as Dictionary.pop, without reading a spilled value back into
+           memory"""
+        self.lock.acquire()
+        try:
+            place = self.__index.get(key)
+            if place is None:
+                return self.__memory.pop(key, default)
+            value = self.__read(place)
+            self.__drop(key)
+            return value
+        finally:
+            self.lock.release()
+
+    def setdefault(self, key, default=None):
+        """Same as Dictionary.setdefault"""
+        self.lock.acquire()
+        try:
+            if key in self:
+                return self[key]
+            self[key] = default
+            return default
+        finally:
+            self.lock.release()
+
+    def popitem(self):
+        """Remove and return an arbitrary (key, value) pair, a spilled one if
+           there are any, so that no other item has to be spilled"""
+        self.lock.acquire()
+        try:
+            entries = chain(self.__index._get_entries(), 
+                            self.__memory._get_entries())
+            for _, key, _ in entries:
+                return key, self.pop(key)
+            raise KeyError('popitem(): dictionary is empty')
+        finally:
+            self.lock.release()
+
+    def copy(self):
+        """Return a copy of the dictionary, which keeps as many items in 
+           memory and spills to a temporary file"""
+        self.lock.acquire()
+        try:
+            new_dict = self.__class__(self.__memory.maxsize)
+            new_dict.update((key, value) for _, key, value in self._get_entries())
+            return new_dict
+        finally:
+            self.lock.release()
+
+    def update(self, other=None, **kwargs):
+        """Same as Dictionary.update"""
+        if hasattr(other, 'keys'):
+            other = other.items()
+        for key, value in chain(other or (), kwargs.items()):
+            self[key] = value
+
+    def clear(self):
+        """Remove all items from the dictionary and empty the segment file"""
+        self.lock.acquire()
+        try:
+            self.__memory.clear()
+            self.__index.clear()
+            self.__segment.seek(0)
+            self.__segment.truncate()
+            self.__live = 0
+            self.__dead = 0
+            self.__promotions = 0
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """Close the segment file"""
+        self.__segment.close()
+
+    def keys(self):
+        """Return a copy of the dictionary's keys"""
+        return [key for _, key, _ in self._get_key_entries()]
+
+    def items(self):
+        """Return a copy of the dictionary's list of (key, value) pairs."""
+        return [(key, value) for _, key, value in self._get_entries()]
+
+    def values(self):
+        """Return a copy of the dictionary's list of values"""
+        return [value for _, _, value in self._get_entries()]
+
+    def iterkeys(self):
+        """Return an iterator over the dictionary's keys"""
+        keys = (key for _, key, _ in self._get_key_entries())
+        return _dictionary_keyiterator(keys, self)
+
+    def iteritems(self):
+        """Return an iterator over the dictionary's (key, value) pairs"""
+        items = ((key, value) for _, key, value in self._get_entries())
+        return _dictionary_itemiterator(items, self)
+
+    def itervalues(self):
+        """Return an iterator over the dictionary's values"""
+        values = (value for _, _, value in self._get_entries())
+        return _dictionary_valueiterator(values, self)
+
+    def viewkeys(self):
+        """Return a new view of the dictionary's keys"""
+        return _dictionary_keys(self)
+
+    def viewvalues(self):
+        """Return a new view of the dictionary's values"""
+        return _dictionary_values(self)
+
+    def viewitems(self):
+        """Return a new view of the dictionary's items (key/value pairs)."""
+        return _dictionary_items(self)
+
+    def compact_segment(self):
+        """Rewrite the segment file with only the values of the spilled keys"""
+        self.lock.acquire()
+        try:
+            old = self.__segment
+            path = None if self.__path is None else self.__path + '.compact'
+            new = self.__open_segment(path)
+            # The new places are only put in the index once the new file is
+            # complete, so if writing it fails, the old file stays in use
+            places = []
+            offset = 0
+            try:
+                for key_hash, key, (old_offset, size) in self.__index._get_entries():
+                    old.seek(old_offset)
+                    new.write(old.read(size))
+                    places.append((key_hash, key, (offset, size)))
+                    offset += size
+                
+                new.flush()
+                if path is not None:
+                    rename(path, self.__path)
+            except Exception:
+                new.close()
+                raise
+            
+            old.close()
+            self.__segment = new
+            for key_hash, key, place in places:
+                self.__index.set_by_hash(key_hash, key, place)
+            self.__dead = 0
+        finally:
+            self.lock.release()
+
+    # The views read the values of the spilled keys from the segment file,
+    # without reading them back into memory
+    def _get_entries(self):
+        spilled = ((key_hash, key, self.__read(place)) 
+                   for key_hash, key, place in self.__index._get_entries())
+        return chain(self.__memory._get_entries(), spilled)
+
+    # The keys of the spilled items are in the index, so their values
+    # aren't read from the segment file
+    def _get_key_entries(self):
+        return chain(self.__memory._get_entries(), self.__index._get_entries())
+
+    def _contains_key(self, key, key_hash):
+        return (self.__memory._contains_key(key, key_hash) or 
+                self.__index._contains_key(key, key_hash))
+
+    def _lookup(self, key, key_hash=None):
+        entry = self.__memory._lookup(key, key_hash)
+        if entry is None:
+            entry = self.__index._lookup(key, key_hash)
+            if entry is not None:
+                key_hash, key, place = entry
+                entry = key_hash, key, self.__read(place)
+        return entry
+
+    @staticmethod
+    def __open_segment(path):
+        return TemporaryFile() if path is None else open(path, 'w+b')
+
+    # Called by the BoundedDictionary in memory with the item it's about to
+    # evict, appends the value to the segment file. The value is flushed to
+    # the file before it's added to the index, so if writing fails, the 
+    # item stays in memory and the insert which evicted it fails. An item
+    # which can't be pickled is marked as used, so it isn't evicted again
+    # by the next insert.
+    def __spill(self, key, value):
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            self.__memory[key]
+            raise
+        segment = self.__segment
+        segment.seek(0, SEEK_END)
+        offset = segment.tell()
+        segment.write(data)
+        segment.flush()
+        self.__index[key] = (offset, len(data))
+        self.__live += len(data)
+
+    def __read(self, place):
+        offset, size = place
+        self.__segment.seek(offset)
+        return pickle.loads(self.__segment.read(size))
+
+    # Removes a spilled key from the index, which leaves its value unused
+    def __drop(self, key):
+        _, size = self.__index.pop(key)
+        self.__live -= size
+        self.__dead += size
+        if self.__dead > max(self.__live, self.__COMPACT_BYTES):
+            self.compact_segment()
@@ -1,18 +1,32 @@
+import errno
+import os
 import random
 import string
 import sys
+import time
 import unittest
+from tempfile import TemporaryFile
 from functools import wraps
 from threading import Thread, RLock
+from multiprocessing.pool import ThreadPool
 
 
 py_version = sys.version_info[0]
 
 
 if py_version == 3:
-    from python3.dictionary import Dictionary
+    import asyncio
+    from io import StringIO
+    from python3.dictionary import (Dictionary, BoundedDictionary, TTLDictionary,
+                                   HashedKey, ResizePolicy,
+                                   AdaptiveResizePolicy, AsyncDictionary,
+                                   SpillDictionary)
 else:
-    from python2.dictionary import Dictionary
+    from StringIO import StringIO
+    from python2.dictionary import (Dictionary, BoundedDictionary, TTLDictionary,
+                                   HashedKey, ResizePolicy,
+                                   AdaptiveResizePolicy,
+                                   SpillDictionary)
     range = xrange
 
 
@@ -38,6 +52,47 @@ def threaded(func):
     return wrapper
 
 
+# A value which can be pickled but not unpickled, to check when a 
+# SpillDictionary reads values back from its segment file
+def unpickle_error():
+    raise AssertionError('value read from the segment file')
+
+class Unloadable(object):
+    def __reduce__(self):
+        return unpickle_error, ()
+
+
+# A key whose hash depends on the process it's hashed in
+class ProcessHash(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, ProcessHash) and self.name == other.name
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.name, os.getpid()))
+
+
+# Wraps the segment file of a SpillDictionary, and fails to write like a
+# full disk while fail is true
+class FailingFile(object):
+    def __init__(self, file):
+        self.file = file
+        self.fail = False
+
+    def write(self, data):
+        if self.fail:
+            raise IOError(errno.ENOSPC, 'No space left on device')
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
 class DictionaryTest(unittest.TestCase):
     def setUp(self):
         self.lock = RLock()
@@ -191,6 +246,840 @@ class DictionaryTest(unittest.TestCase):
             msg="Popitem returned '{}', should return '{}'".format(excpt_msg, 
                                                                    msg)) 
 
+    def test_attribute_access(self):
+        self.dictionary = Dictionary(a=1)
+        self.dictionary.b = 2
+        self.assertEqual(self.dictionary.a, 1)
+        self.assertEqual(self.dictionary['b'], 2)
+        del self.dictionary.a
+        self.assertNotIn('a', self.dictionary)
+        self.assertRaises(KeyError, getattr, self.dictionary, '__dict__')
+        self.assertRaises(AttributeError, setattr, 
+                          self.dictionary.keys(), 'a', 1)
+
+    def test_small_table(self):
+        self.dictionary = Dictionary()
+        for i in range(7):
+            self.dictionary[i * 8] = i
+        self.assertEqual(len(self.dictionary.debug), 8)
+        
+        self.dictionary[100] = 7
+        self.assertEqual(len(self.dictionary.debug), 32)
+        
+        for i in range(7):
+            del self.dictionary[i * 8]
+        self.dictionary['a'] = 1
+        self.assertEqual(len(self.dictionary.debug), 8)
+        self.assertEqual(self.dictionary[100], 7)
+        self.assertEqual(self.dictionary.a, 1)
+        self.assertNotIn(0, self.dictionary)
+
+    def test_view_set_operations(self):
+        self.dictionary = Dictionary(a=1, b=2, c=3)
+        other = Dictionary(b=2, c=4, d=5)
+        if py_version == 3:
+            keys, other_keys = self.dictionary.keys(), other.keys()
+            items, other_items = self.dictionary.items(), other.items()
+        else:
+            keys, other_keys = self.dictionary.viewkeys(), other.viewkeys()
+            items, other_items = self.dictionary.viewitems(), other.viewitems()
+        
+        self.assertEqual(keys & other_keys, {'b', 'c'})
+        self.assertEqual(keys | ['e'], {'a', 'b', 'c', 'e'})
+        self.assertEqual(keys - other_keys, {'a'})
+        self.assertEqual({'a', 'e'} ^ keys, {'b', 'c', 'e'})
+        self.assertEqual(items & other_items, {('b', 2)})
+        self.assertEqual(items - {('a', 1)}, {('b', 2), ('c', 3)})
+        
+        self.assertTrue(keys >= {'a', 'b'})
+        self.assertFalse(keys <= other_keys)
+        self.assertTrue(keys.isdisjoint(['e', 'f']))
+        self.assertFalse(items.isdisjoint(other_items))
+        
+        intersection = keys.intersection(other_keys)
+        self.assertEqual(sorted(intersection), ['b', 'c'])
+        self.assertIn('b', intersection)
+        self.assertEqual(sorted(keys.symmetric_difference(other_keys)), 
+                         ['a', 'd'])
+
+    def test_repr(self):
+        self.dictionary = Dictionary([(i, str(i)) for i in range(5)])
+        self.assertEqual(repr(self.dictionary), 
+                         "{0: '0', 1: '1', 2: '2', 3: '3', 4: '4'}")
+        self.assertEqual(self.dictionary.format_repr(max_items=2), 
+                         "{0: '0', 1: '1', ...}")
+        self.assertEqual(repr(Dictionary()), '{}')
+        
+        stream = StringIO()
+        self.dictionary.write_repr(stream, max_items=3)
+        self.assertEqual(stream.getvalue(), "{0: '0', 1: '1', 2: '2', ...}")
+        self.assertEqual(repr(Dictionary([((1, 2), 'a')]).keys()), 
+                         '[(1, 2)]' if py_version == 2 else 
+                         'dictionary_keys([(1, 2)])')
+
+    def test_equality(self):
+        self.dictionary = Dictionary((i, i) for i in range(100))
+        other = Dictionary((i, i) for i in reversed(range(100)))
+        self.assertEqual(self.dictionary, other)
+        
+        other[0] = -1
+        self.assertNotEqual(self.dictionary, other)
+        del other[0]
+        self.assertNotEqual(self.dictionary, other)
+
+    def test_fingerprint(self):
+        self.dictionary = Dictionary((i, i) for i in range(100))
+        other = Dictionary((i, i) for i in range(100))
+        self.assertEqual(self.dictionary.fingerprint, None)
+        self.dictionary.track_fingerprint()
+        other.track_fingerprint()
+        self.assertEqual(self.dictionary.fingerprint, other.fingerprint)
+        
+        for i in range(50):
+            del other[i]
+        for i in range(50):
+            other[i] = i
+        self.assertEqual(self.dictionary.fingerprint, other.fingerprint)
+        
+        other[0] = 1
+        self.assertNotEqual(self.dictionary.fingerprint, other.fingerprint)
+        self.assertNotEqual(self.dictionary, other)
+        
+        other[0] = []
+        self.assertEqual(other.fingerprint, None)
+        self.assertRaises(TypeError, other.track_fingerprint)
+
+    @threaded
+    def increment_all(self, n):
+        for i in range(n):
+            self.dictionary.increment(i % 10)
+
+    def test_read_modify_write(self):
+        self.dictionary = Dictionary()
+        threads = [self.increment_all(1000) for _ in range(10)]
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(self.dictionary.items()), 
+                         [(i, 1000) for i in range(10)])
+        
+        self.assertEqual(self.dictionary.upsert('a', lambda v: v + [1], []), [1])
+        self.assertEqual(self.dictionary.get_or_insert('a', list), [1])
+        self.assertEqual(self.dictionary.setdefault('b', 2), 2)
+        self.assertEqual(self.dictionary.pop_if('b', lambda v: v > 2), None)
+        self.assertEqual(self.dictionary.pop_if('b', lambda v: v == 2), 2)
+        self.assertNotIn('b', self.dictionary)
+
+    def test_lookup_by_hash(self):
+        dictionaries = [Dictionary((j, i) for j in range(i, 20)) 
+                        for i in range(10)]
+        keys = [HashedKey(i) for i in (5, 15, 25)]
+        
+        self.assertEqual(dictionaries[6].get_many(keys), [None, 6, None])
+        self.assertEqual([d.get_by_hash(keys[0].hash, 5, -1) for d in dictionaries],
+                         [0, 1, 2, 3, 4, 5, -1, -1, -1, -1])
+        
+        self.dictionary = dictionaries[0]
+        self.dictionary.set_by_hash(hash('a'), 'a', 1)
+        self.dictionary.set_many((key, 0) for key in keys)
+        self.assertEqual(self.dictionary['a'], 1)
+        self.assertEqual(self.dictionary[25], 0)
+        self.assertEqual(len(self.dictionary), 22)
+
+    def test_join(self):
+        self.dictionary = Dictionary((i, i) for i in range(10))
+        other = Dictionary((i, -i) for i in range(5, 100))
+        
+        self.assertEqual(sorted(self.dictionary.join(other)), 
+                         [(i, i, -i) for i in range(5, 10)])
+        self.assertEqual(sorted(other.join(self.dictionary)), 
+                         [(i, -i, i) for i in range(5, 10)])
+        self.assertEqual(sorted(self.dictionary.join(other, how='left')),
+                         [(i, i, -i if i >= 5 else None) for i in range(10)])
+        self.assertRaises(ValueError, self.dictionary.join, other, 'outer')
+
+    def test_group_by(self):
+        self.dictionary = Dictionary.group_by(range(10), lambda i: i % 3)
+        self.assertEqual(sorted(self.dictionary.items()), 
+                         [(0, [0, 3, 6, 9]), (1, [1, 4, 7]), (2, [2, 5, 8])])
+
+    def test_bloom_filter(self):
+        self.dictionary = Dictionary()
+        self.dictionary.enable_bloom_filter()
+        for i in range(100):
+            self.dictionary[i] = i
+        for i in range(100):
+            self.assertEqual(self.dictionary[i], i)
+        for i in range(100, 1000):
+            self.assertFalse(i in self.dictionary)
+        
+        for i in range(0, 100, 2):
+            del self.dictionary[i]
+        self.dictionary.rebuild_bloom_filter()
+        self.assertEqual(sorted(self.dictionary), list(range(1, 100, 2)))
+        self.assertEqual(self.dictionary.get(2, 'missing'), 'missing')
+        
+        self.dictionary.disable_bloom_filter()
+        self.assertEqual(self.dictionary[99], 99)
+
+    def test_bulk_delete(self):
+        self.dictionary = Dictionary((i, i) for i in range(1000))
+        self.assertEqual(self.dictionary.delete_where(lambda k, v: v % 2), 500)
+        self.assertEqual(self.dictionary.retain(lambda k, v: k < 100), 450)
+        self.assertEqual(sorted(self.dictionary), list(range(0, 100, 2)))
+        self.assertEqual(len(self.dictionary.debug), 128)
+        
+        self.assertEqual(self.dictionary.delete_many(range(0, 90, 2)), 45)
+        self.assertEqual(self.dictionary.delete_many([90, 1, 'a']), 1)
+        self.assertEqual(sorted(self.dictionary.items()), 
+                         [(92, 92), (94, 94), (96, 96), (98, 98)])
+        self.assertEqual(len(self.dictionary.debug), 8)
+        self.dictionary[1] = 1
+        self.assertEqual(self.dictionary[1], 1)
+        
+        bounded = BoundedDictionary(10, sequence=((i, i) for i in range(10)))
+        self.assertEqual(bounded.delete_where(lambda k, v: v < 5), 5)
+        self.assertEqual(bounded.delete_many([5, 6, 11]), 2)
+        self.assertEqual(sorted(bounded.items()), [(7, 7), (8, 8), (9, 9)])
+
+    def test_delete_where_failing_pred(self):
+        def pred(key, value):
+            if key == 50:
+                raise ValueError(key)
+            return key % 2
+        
+        a = Dictionary((i, i) for i in range(100))
+        b = Dictionary((i, i) for i in range(100))
+        a.track_fingerprint()
+        b.track_fingerprint()
+        self.assertRaises(ValueError, a.delete_where, pred)
+        self.assertEqual(len(a), 100)
+        self.assertEqual(a, b)
+
+    def test_resize_policy(self):
+        self.dictionary = Dictionary()
+        policy = self.dictionary.resize_policy
+        for i in range(1000):
+            self.dictionary[i] = i
+        self.assertEqual(policy.grows, 4)
+        self.assertEqual(len(self.dictionary.debug), 2048)
+        self.assertIs(self.dictionary.resize_policy, policy)
+        self.assertEqual(Dictionary().resize_policy.grows, 0)
+        
+        # Going up and down around a boundary doesn't resize every time
+        for _ in range(100):
+            self.dictionary[1000] = 1000
+            del self.dictionary[1000]
+        self.assertEqual(policy.stats(), 
+                         Dictionary(grows=4, shrinks=0, cleanups=0))
+        
+        policy = ResizePolicy.memory()
+        self.dictionary.set_resize_policy(policy)
+        self.assertEqual(len(self.dictionary.debug), 2048)
+        self.dictionary.delete_many(range(600))
+        self.assertEqual(len(self.dictionary.debug), 1024)
+        for i in range(1000):
+            self.assertEqual(self.dictionary.get(i), i if i >= 600 else None)
+        
+        self.dictionary.set_resize_policy(ResizePolicy.throughput())
+        self.assertEqual(len(self.dictionary.debug), 2048)
+        self.assertRaises(ValueError, ResizePolicy, growth=3)
+        self.assertRaises(ValueError, ResizePolicy, max_load=1.5)
+
+    def test_adaptive_resize_policy(self):
+        self.dictionary = Dictionary()
+        policy = AdaptiveResizePolicy()
+        self.dictionary.set_resize_policy(policy)
+        for i in range(1000):
+            self.dictionary[i] = i
+        # Only inserts, so the table grows as fast as it's allowed to
+        self.assertEqual(policy.growth, 8)
+        self.assertTrue(policy.adjustments > 0)
+        
+        max_load = policy.max_load
+        for i in range(1000, 20000):
+            self.assertFalse(i in self.dictionary)
+            self.dictionary[i] = i
+        stats = policy.stats()
+        self.assertTrue(stats['miss_ratio'] >= 0.5)
+        self.assertTrue(stats['max_load'] < max_load)
+        self.assertTrue(stats['max_load'] >= 0.4)
+        for i in range(20000):
+            self.assertEqual(self.dictionary[i], i)
+        
+        self.assertRaises(ValueError, AdaptiveResizePolicy, 
+                          load_bounds=(0.7, 0.9))
+
+    def test_flood_protection(self):
+        self.dictionary = Dictionary()
+        self.assertEqual(self.dictionary.flood_stats(), None)
+        self.dictionary.enable_flood_protection(max_probes=8)
+        keys = [i << 40 for i in range(1000)]
+        for key in keys:
+            self.dictionary[key] = key
+        for key in keys:
+            self.assertEqual(self.dictionary[key], key)
+        
+        # Keys with equal hashes can't be told apart by any seed, so they
+        # don't make the table pick a new one
+        class Colliding(object):
+            def __hash__(self):
+                return 42
+        colliding = [Colliding() for _ in range(200)]
+        flooded = Dictionary()
+        flooded.enable_flood_protection(max_probes=8)
+        for key in colliding:
+            flooded[key] = 1
+        self.assertEqual(flooded.flood_stats()['reseeds'], 0)
+        self.assertEqual(len(flooded), 200)
+        self.assertTrue(all(key in flooded for key in colliding))
+        
+        self.dictionary.disable_flood_protection()
+        self.assertEqual(self.dictionary.flood_stats(), None)
+        self.assertEqual(sum(1 for key in keys if key in self.dictionary), 1000)
+
+    def test_build_parallel(self):
+        pairs = [(str(i % 700), i) for i in range(1000)]
+        self.dictionary = Dictionary.build_parallel(pairs, workers=2, 
+                                                    chunk_size=64)
+        self.assertEqual(self.dictionary, Dictionary(pairs))
+        self.assertEqual(self.dictionary['5'], 705)
+        
+        other = Dictionary.build_parallel(self.dictionary, workers=2)
+        self.assertEqual(other, self.dictionary)
+        self.assertRaises(ValueError, Dictionary.build_parallel, [(1, 2, 3)])
+
+    def test_build_parallel_process_hashes(self):
+        pairs = [(ProcessHash(i), i) for i in range(100)]
+        pairs += [(None, 'none'), ((1, None), 'tuple'), (1.5, 'float')]
+        self.dictionary = Dictionary.build_parallel(pairs, workers=2, 
+                                                    chunk_size=16)
+        self.assertEqual(self.dictionary, Dictionary(pairs))
+        self.assertEqual(self.dictionary[ProcessHash(5)], 5)
+        self.assertEqual(self.dictionary[1, None], 'tuple')
+
+    def test_map_values_failing_fn(self):
+        def fn(value):
+            if value == 900:
+                raise ValueError(value)
+            return -value
+        
+        for dictionary in (Dictionary((i, i) for i in range(1000)), 
+                           BoundedDictionary(1000, sequence=[(i, i) for i in range(1000)])):
+            self.assertRaises(ValueError, dictionary.map_values, fn, None, 64)
+            self.assertEqual(sorted(dictionary.values()), list(range(1000)))
+
+    def test_map_filter_reduce(self):
+        self.dictionary = Dictionary((i, i) for i in range(1000))
+        self.dictionary.track_fingerprint()
+        pool = ThreadPool(4)
+        try:
+            self.dictionary.map_values(lambda value: value * 2, pool, 64)
+            self.assertEqual(self.dictionary, 
+                             Dictionary((i, i * 2) for i in range(1000)))
+            self.dictionary.map_values(lambda value: value // 2)
+            expected = Dictionary((i, i) for i in range(1000))
+            expected.track_fingerprint()
+            self.assertEqual(self.dictionary.fingerprint, expected.fingerprint)
+            
+            even = self.dictionary.filter_items(lambda k, v: v % 2 == 0, pool, 64)
+            self.assertEqual(sorted(even), list(range(0, 1000, 2)))
+            
+            add = lambda acc, key, value: acc + value
+            self.assertEqual(self.dictionary.reduce_items(add, 0), 499500)
+            self.assertEqual(self.dictionary.reduce_items(
+                add, 0, pool, lambda a, b: a + b, 64), 499500)
+            self.assertRaises(TypeError, self.dictionary.reduce_items, 
+                              add, 0, pool)
+            
+            bounded = BoundedDictionary(10, sequence=[(1, 1), (2, 2)])
+            bounded.map_values(lambda value: -value, pool)
+            self.assertEqual(sorted(bounded.items()), [(1, -1), (2, -2)])
+            self.assertEqual(bounded.reduce_items(add, 0), -3)
+        finally:
+            pool.close()
+            pool.join()
+
+    def test_front_cache(self):
+        self.dictionary = Dictionary()
+        self.assertEqual(self.dictionary.front_cache_stats(), None)
+        self.assertRaises(ValueError, self.dictionary.enable_front_cache, 100)
+        self.dictionary.enable_front_cache(16)
+        self.dictionary['hot'] = 1
+        for _ in range(10):
+            self.assertEqual(self.dictionary['hot'], 1)
+        stats = self.dictionary.front_cache_stats()
+        self.assertEqual(stats['hits'] + stats['misses'], 10)
+        self.assertTrue(stats['hits'] >= 9)
+        
+        self.dictionary['hot'] = 2
+        self.assertEqual(self.dictionary['hot'], 2)
+        del self.dictionary['hot']
+        self.assertFalse('hot' in self.dictionary)
+        
+        # The entries move when the table is resized
+        self.dictionary['hot'] = 3
+        self.dictionary['hot']
+        for i in range(1000):
+            self.dictionary[i] = i
+        self.assertEqual(self.dictionary['hot'], 3)
+        for i in range(1000):
+            self.assertEqual(self.dictionary[i], i)
+        self.dictionary.disable_front_cache()
+        self.assertEqual(self.dictionary['hot'], 3)
+
+    def test_version(self):
+        self.dictionary = Dictionary(a=1, b=2)
+        version = self.dictionary.version
+        self.dictionary['a'] = 3
+        self.assertTrue(self.dictionary.version > version)
+        version = self.dictionary.version
+        self.assertEqual(self.dictionary['a'], 3)
+        self.assertEqual(self.dictionary.version, version)
+        
+        # Values can be changed while iterating, but a delete followed by
+        # an insert is caught even though the size is the same
+        for key in self.dictionary:
+            self.dictionary[key] = 0
+        def replace():
+            for key in self.dictionary:
+                del self.dictionary[key]
+                self.dictionary['c'] = 3
+        self.assertRaises(RuntimeError, replace)
+        
+        bounded = BoundedDictionary(2, sequence=[('a', 1)])
+        version = bounded.version
+        bounded['a'] = 2
+        self.assertTrue(bounded.version > version)
+        
+        version = self.dictionary.version
+        self.dictionary.delete_where(lambda key, value: True)
+        self.assertTrue(self.dictionary.version > version)
+
+    def test_memory_report(self):
+        dictionary = Dictionary((str(i), [i] * 10) for i in range(1000))
+        report = dictionary.memory_report(sample=None)
+        
+        self.assertEqual(report['table'], sys.getsizeof(dictionary.debug))
+        self.assertEqual(report['tombstones'], 0)
+        self.assertEqual(report['keys'], 
+                         sum(sys.getsizeof(str(i)) for i in range(1000)))
+        self.assertEqual(dictionary.__sizeof__(), report['total'] - 
+                         report['keys'] - report['values'])
+        self.assertGreater(sys.getsizeof(dictionary), report['table'])
+        deep = dictionary.memory_report(deep=True, sample=None)
+        self.assertGreater(deep['values'], report['values'])
+        
+        for i in range(100):
+            del dictionary[str(i)]
+        report = dictionary.memory_report()
+        self.assertGreater(report['tombstones'], 0)
+        self.assertGreater(report['keys'], 0)
+        dictionary.enable_bloom_filter()
+        self.assertEqual(dictionary.memory_report()['auxiliary'] - 
+                         report['auxiliary'],
+                         sys.getsizeof(bytearray(len(dictionary.debug))))
+        
+        items = [(i, [i]) for i in range(1000)]
+        plain = Dictionary(items).memory_report(deep=True, sample=None)
+        bounded = BoundedDictionary(1000, sequence=items)
+        report = bounded.memory_report(deep=True, sample=None)
+        self.assertEqual(report['values'], plain['values'])
+        self.assertGreater(report['auxiliary'], plain['auxiliary'] + 
+                           1000 * sys.getsizeof([]))
+
+    def test_lock_stats(self):
+        dictionary = Dictionary()
+        self.assertEqual(dictionary.lock_stats(), None)
+        dictionary.enable_lock_stats()
+        for i in range(1000):
+            dictionary[i] = i
+        dictionary.lock.acquire()
+        dictionary.pop(0)
+        dictionary.lock.release()
+        
+        stats = dictionary.lock_stats()
+        self.assertEqual(stats['acquisitions'], 1001)
+        self.assertEqual(stats['contended'], 0)
+        self.assertGreater(stats['resizes'], 0)
+        self.assertEqual(sum(stats['holds'].values()) + stats['resizes'], 1001)
+        self.assertEqual(sum(stats['resize_holds'].values()), stats['resizes'])
+        
+        dictionary.lock.acquire()
+        thread = threaded(dictionary.__setitem__)(0, 0)
+        time.sleep(0.05)
+        dictionary.lock.release()
+        thread.join()
+        stats = dictionary.lock_stats()
+        self.assertEqual(stats['contended'], 1)
+        self.assertGreater(stats['max_wait'], 0.02)
+        
+        dictionary.clear()
+        self.assertEqual(dictionary.lock_stats()['acquisitions'], 1003)
+        dictionary.disable_lock_stats()
+        self.assertEqual(dictionary.lock_stats(), None)
+
+    def test_iter_chunks(self):
+        dictionary = Dictionary((i, -i) for i in range(1000))
+        chunks = list(dictionary.iter_chunks(300, 'keys'))
+        
+        self.assertEqual([len(chunk) for chunk in chunks], [300, 300, 300, 100])
+        self.assertEqual(sorted(sum(chunks, [])), list(range(1000)))
+        self.assertEqual(sorted(sum(dictionary.iter_chunks(kind='values'), [])),
+                         sorted(dictionary.values()))
+        self.assertEqual(sum(dictionary.items_batched(64), []), 
+                         list(dictionary.items()))
+        self.assertRaises(ValueError, next, dictionary.iter_chunks(kind='key'))
+        self.assertRaises(ValueError, next, dictionary.iter_chunks(0))
+        self.assertRaises(ValueError, dictionary.scan, None, 0)
+        
+        chunks = dictionary.iter_chunks(100)
+        next(chunks)
+        dictionary[1000] = 0
+        self.assertRaises(RuntimeError, next, chunks)
+        
+        bounded = BoundedDictionary(10, sequence=[(i, i) for i in range(20)])
+        self.assertEqual(sorted(sum(bounded.items_batched(3), [])), 
+                         [(i, i) for i in range(10, 20)])
+
+    def test_scan(self):
+        dictionary = Dictionary((i, i) for i in range(1000))
+        cursor, chunk = dictionary.scan(count=100)
+        keys = [key for key, _ in chunk]
+        dictionary[0] = 'a'
+        del dictionary[999]
+        while cursor is not None:
+            cursor, chunk = dictionary.scan(cursor, 100, 'keys')
+            keys.extend(chunk)
+        
+        self.assertEqual(sorted(set(keys) - {999}), list(range(999)))
+        self.assertEqual(len(set(keys)), len(keys))
+        
+        cursor, _ = dictionary.scan(count=10)
+        dictionary.clear()
+        self.assertEqual(dictionary.scan(cursor)[1], [])
+        self.assertEqual(dictionary.scan(), (None, []))
+        
+        dictionary = Dictionary(a=1, b=2)
+        cursor, chunk = dictionary.scan(count=1)
+        self.assertEqual((cursor, sorted(chunk)), (None, [('a', 1), ('b', 2)]))
+
+    def test_scan_resized(self):
+        dictionary = Dictionary((i, i) for i in range(1000))
+        cursor, chunk = dictionary.scan(count=100)
+        items = list(chunk)
+        deleted, changed = [i for i in range(1000) if (i, i) not in chunk][:2]
+        for i in range(1000, 5000):
+            dictionary[i] = i
+        del dictionary[deleted]
+        dictionary[changed] = 'a'
+        while cursor is not None:
+            cursor, chunk = dictionary.scan(cursor, 100)
+            items.extend(chunk)
+        
+        keys = [key for key, _ in items]
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertEqual(set(range(1000)) - set(keys), set([deleted]))
+        self.assertIn((changed, 'a'), items)
+
+
+class BoundedDictionaryTest(unittest.TestCase):
+    def test_lru_eviction(self):
+        dictionary = BoundedDictionary(3)
+        dictionary['a'] = 1
+        dictionary['b'] = 2
+        dictionary['c'] = 3
+        dictionary['a']
+        dictionary['d'] = 4
+        
+        self.assertEqual(sorted(dictionary.keys()), ['a', 'c', 'd'])
+        stats = dictionary.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']),
+                         (1, 0, 1))
+        self.assertEqual(dictionary.pop('b', 0), 0)
+        self.assertEqual(dictionary.pop('b', None), None)
+        self.assertRaises(KeyError, dictionary.pop, 'b')
+
+    def test_lfu_eviction(self):
+        dictionary = BoundedDictionary(3, policy='lfu')
+        dictionary['a'] = 1
+        dictionary['b'] = 2
+        dictionary['c'] = 3
+        dictionary['a']
+        dictionary['b']
+        self.assertEqual(dictionary.get('e'), None)
+        dictionary['d'] = 4
+        dictionary['e'] = 5
+        
+        self.assertEqual(sorted(dictionary.items()), 
+                         [('a', 1), ('b', 2), ('e', 5)])
+        stats = dictionary.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']),
+                         (2, 1, 2))
+
+    def test_many_insertions(self):
+        dictionary = BoundedDictionary(100)
+        for i in range(1000):
+            dictionary[i] = i
+        
+        self.assertEqual(len(dictionary), 100)
+        self.assertEqual(sorted(dictionary.values()), list(range(900, 1000)))
+        self.assertEqual(dictionary.pop(999), 999)
+        self.assertRaises(KeyError, dictionary.__getitem__, 0)
+
+    def test_increment(self):
+        dictionary = BoundedDictionary(2)
+        for key in 'aababc':
+            dictionary.increment(key)
+        self.assertEqual(sorted(dictionary.items()), [('b', 2), ('c', 1)])
+
+
+class TTLDictionaryTest(unittest.TestCase):
+    def setUp(self):
+        self.time = 0.0
+        self.dictionary = TTLDictionary(10, clock=lambda: self.time)
+
+    def test_lookup_expired_key(self):
+        self.dictionary['a'] = 1
+        self.dictionary.set('b', 2, ttl=100)
+        self.time = 10
+        
+        self.assertNotIn('a', self.dictionary)
+        self.assertEqual(self.dictionary['b'], 2)
+        self.assertEqual(len(self.dictionary), 1)
+        self.assertEqual(self.dictionary.pop('a', 3), 3)
+        self.assertEqual(self.dictionary.pop('a', 0), 0)
+        self.assertRaises(KeyError, self.dictionary.pop, 'a')
+
+    def test_expire(self):
+        for i in range(1000):
+            self.time = i * 0.01
+            self.dictionary[i] = i
+        self.time = 15
+        
+        self.assertEqual(self.dictionary.expire(limit=10), 10)
+        self.assertEqual(self.dictionary.expire(), 490)
+        self.assertEqual(sorted(self.dictionary.keys()), list(range(501, 1000)))
+        
+        self.time = 10**6
+        self.assertEqual(self.dictionary.expire(), 500)
+        self.assertEqual(len(self.dictionary), 0)
+
+    def test_len_and_equality(self):
+        self.dictionary['a'] = 1
+        self.dictionary.set('b', 2, ttl=100)
+        self.time = 10.5
+        
+        self.assertEqual(self.dictionary, Dictionary(b=2))
+        self.assertEqual(Dictionary(b=2), self.dictionary)
+        self.assertNotEqual(self.dictionary, Dictionary(a=1, b=2))
+        self.time = 11
+        self.assertEqual(len(self.dictionary), 1)
+        self.assertEqual(len(self.dictionary.items()), 1)
+        
+        other = TTLDictionary(1, clock=lambda: self.time)
+        other.set('b', 2, ttl=5)
+        other['c'] = 3
+        self.time = 12
+        self.assertEqual(other, self.dictionary)
+        self.assertEqual(self.dictionary, other)
+        self.time = 200
+        self.assertFalse(self.dictionary)
+
+    def test_overwrite(self):
+        for i in range(1000):
+            self.time = i * 0.1
+            self.dictionary['a'] = i
+        self.assertEqual(sum(self.dictionary._TTLDictionary__scheduled), 1)
+        
+        self.time = 105
+        self.assertEqual(self.dictionary['a'], 999)
+        self.dictionary.set('a', 1000, ttl=1)
+        self.time = 111
+        self.assertEqual(self.dictionary.expire(), 1)
+        self.assertEqual(sum(self.dictionary._TTLDictionary__scheduled), 0)
+
+
+class SpillDictionaryTest(unittest.TestCase):
+    def setUp(self):
+        self.dictionary = SpillDictionary(10)
+    
+    def tearDown(self):
+        self.dictionary.close()
+
+    def test_spill(self):
+        for i in range(100):
+            self.dictionary[i] = str(i)
+        
+        self.assertEqual(len(self.dictionary), 100)
+        stats = self.dictionary.stats()
+        self.assertEqual((stats['memory'], stats['spilled'], stats['spills']),
+                         (10, 90, 90))
+        self.assertEqual(self.dictionary[0], '0')
+        self.assertEqual(self.dictionary.get(1), '1')
+        self.assertEqual(self.dictionary.get(100), None)
+        self.assertEqual(self.dictionary.stats()['promotions'], 2)
+        self.assertIn(50, self.dictionary)
+        self.assertEqual(sorted(self.dictionary.items()), 
+                         [(i, str(i)) for i in range(100)])
+
+    def test_overwrite_and_delete(self):
+        for i in range(100):
+            self.dictionary[i] = i
+        self.dictionary[0] = 'a'
+        del self.dictionary[1]
+        del self.dictionary[99]
+        
+        self.assertEqual(self.dictionary.pop(2), 2)
+        self.assertEqual(self.dictionary.pop(2, 'b'), 'b')
+        self.assertEqual(self.dictionary.pop(2, 0), 0)
+        self.assertRaises(KeyError, self.dictionary.pop, 2)
+        self.assertRaises(KeyError, self.dictionary.__delitem__, 1)
+        self.assertEqual(len(self.dictionary), 97)
+        self.assertEqual(self.dictionary[0], 'a')
+        
+        live = self.dictionary.stats()['live_bytes']
+        self.assertGreater(self.dictionary.stats()['dead_bytes'], 0)
+        self.dictionary.compact_segment()
+        stats = self.dictionary.stats()
+        self.assertEqual((stats['live_bytes'], stats['dead_bytes']), (live, 0))
+        self.assertEqual(sorted(self.dictionary.values(), key=str)[-1], 'a')
+        self.assertEqual(sorted(self.dictionary.keys()), 
+                         [0] + list(range(3, 99)))
+        
+        self.dictionary.clear()
+        self.assertEqual(len(self.dictionary), 0)
+        self.assertEqual(self.dictionary.stats()['live_bytes'], 0)
+
+
+    def test_keys_without_reading(self):
+        for i in range(100):
+            self.dictionary[i] = Unloadable()
+        
+        self.assertEqual(sorted(self.dictionary), list(range(100)))
+        self.assertEqual(len(self.dictionary), 100)
+        keys = (self.dictionary.keys() if py_version == 3 else 
+                self.dictionary.viewkeys())
+        self.assertEqual(keys & {1, 2, 100}, {1, 2})
+        self.assertIn(1, keys)
+
+    def test_mapping_api(self):
+        for i in range(30):
+            self.dictionary[i] = i
+        self.assertEqual(self.dictionary.setdefault(0, 'a'), 0)
+        self.assertEqual(self.dictionary.setdefault(30, 'a'), 'a')
+        
+        other = self.dictionary.copy()
+        try:
+            self.assertEqual(other, self.dictionary)
+            self.assertEqual(self.dictionary, Dictionary(other.items()))
+            self.assertEqual(Dictionary(other.items()), self.dictionary)
+            key, value = other.popitem()
+            self.assertEqual(self.dictionary[key], value)
+            self.assertNotEqual(other, self.dictionary)
+            while other:
+                other.popitem()
+            self.assertRaises(KeyError, other.popitem)
+        finally:
+            other.close()
+        self.assertEqual(len(self.dictionary), 31)
+        self.assertRaises(TypeError, hash, self.dictionary)
+
+    def test_failing_segment_file(self):
+        segment = FailingFile(self.dictionary._SpillDictionary__segment)
+        self.dictionary._SpillDictionary__segment = segment
+        for i in range(20):
+            self.dictionary[i] = i
+        
+        segment.fail = True
+        self.assertRaises(IOError, self.dictionary.__getitem__, 0)
+        self.assertRaises(IOError, self.dictionary.__setitem__, 1, 'a')
+        self.assertRaises(IOError, self.dictionary.__setitem__, 20, 20)
+        segment.fail = False
+        self.assertEqual(sorted(self.dictionary), list(range(20)))
+        self.assertEqual(len(self.dictionary), 20)
+        self.assertEqual(self.dictionary[0], 0)
+        self.assertEqual(self.dictionary[1], 1)
+
+    def test_failing_compaction(self):
+        segments = []
+        
+        def open_segment(path):
+            segments.append(FailingFile(TemporaryFile()))
+            if len(segments) > 1:
+                # The values get written to the new file, which then fails
+                # to flush them
+                segments[-1].flush = fail_flush
+            return segments[-1]
+        
+        def fail_flush():
+            raise IOError(errno.ENOSPC, 'No space left on device')
+        
+        class FailingSpillDictionary(SpillDictionary):
+            _SpillDictionary__open_segment = staticmethod(open_segment)
+        
+        self.dictionary.close()
+        self.dictionary = FailingSpillDictionary(10)
+        for i in range(30):
+            self.dictionary[i] = i
+        del self.dictionary[0]
+        self.assertRaises(IOError, self.dictionary.compact_segment)
+        self.assertEqual(len(segments), 2)
+        self.assertIs(self.dictionary._SpillDictionary__segment, segments[0])
+        self.assertEqual(dict(self.dictionary.items()), 
+                         dict((i, i) for i in range(1, 30)))
+
+    def test_unpicklable_value(self):
+        self.dictionary['a'] = lambda: 0
+        for i in range(9):
+            self.dictionary[i] = i
+        self.assertRaises(Exception, self.dictionary.__setitem__, 9, 9)
+        self.assertNotIn(9, self.dictionary)
+        self.dictionary[9] = 9
+        self.assertEqual(len(self.dictionary), 11)
+        self.assertEqual(self.dictionary['a'](), 0)
+        
+        def on_evict(key, value):
+            raise IOError(key)
+        bounded = BoundedDictionary(1, sequence=[('a', 1)], on_evict=on_evict)
+        self.assertRaises(IOError, bounded.__setitem__, 'b', 2)
+        self.assertEqual(list(bounded.items()), [('a', 1)])
+
+@unittest.skipIf(py_version == 2, 'AsyncDictionary needs Python 3')
+class AsyncDictionaryTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.ticks = 0
+    
+    def tearDown(self):
+        self.loop.close()
+    
+    def tick(self):
+        self.ticks += 1
+        self.handle = self.loop.call_soon(self.tick)
+    
+    def test_update_many(self):
+        dictionary = AsyncDictionary(chunk_size=100)
+        self.loop.call_soon(self.tick)
+        self.loop.run_until_complete(
+            dictionary.update_many((i, i) for i in range(10000)))
+        self.handle.cancel()
+        
+        # The loop got control back between the chunks and the resizes
+        self.assertTrue(self.ticks >= 100)
+        self.assertEqual(len(dictionary), 10000)
+        for i in range(10000):
+            self.assertEqual(dictionary[i], i)
+        
+        run = self.loop.run_until_complete
+        run(dictionary.set('a', 1))
+        self.assertEqual(run(dictionary.get('a')), 1)
+        run(dictionary.delete('a'))
+        self.assertEqual(run(dictionary.get('a', 2)), 2)
+        self.assertRaises(KeyError, run, dictionary.delete('a'))
+        
+        run(dictionary.update_many(Dictionary(a=1, b=2)))
+        self.assertEqual(run(dictionary.get('b')), 2)
+
 
 if __name__ == '__main__':
     unittest.main()